@@ -1,5 +1,6 @@
 import itertools
 import os
+from collections import OrderedDict, namedtuple
 from datetime import date
 from datetime import timedelta
 from decimal import Decimal
@@ -8,23 +9,17 @@ import re
 
 from authentication.models import UserProfile
 from django.conf import settings
-from django.contrib.auth import get_user_model
 from django.core.cache import cache
-from django.core.exceptions import ObjectDoesNotExist
 from django.core.mail import EmailMultiAlternatives
-from django.db import transaction
-from django.db.models import Q
+from django.db.models import F, Q, Sum
 from django.utils import timezone
 from django_cron import CronJobBase, Schedule
-from harvest.hooks import hookset as harvest_hookset
 from harvest.utils import TokensManager
 from python_http_client.exceptions import BadRequestsError
 from teams.models import Team, Membership
-from toggl.hooks import hookset as toggl_hookset
 
-from projects.models import Project
-
-UserModel = get_user_model()
+from projects.jobs import enqueue_team_import, get_provider_credentials
+from projects.models import Project, ProviderProjectLink, WeeklyHours
 
 
 class RefreshHarvestTokensCronJob(CronJobBase):
@@ -120,6 +115,9 @@ class TrailExpirationCronJob(CronJobBase):
                             'expired')
 
 
+ImportUnit = namedtuple('ImportUnit', ['team_id', 'provider', 'user'])
+
+
 class ImportHoursCronJob(CronJobBase):
     RUN_AT_TIMES = ['05:00']
     schedule = Schedule(run_at_times=RUN_AT_TIMES)
@@ -127,38 +125,42 @@ class ImportHoursCronJob(CronJobBase):
     code = 'albatross_api.cron.ImportHoursCronJob'
 
     @staticmethod
-    def update_projects(user, api_key, hookset):
-        try:
-            membership = Membership.objects.get(user=user)
-            projects = membership.team.projects.all()
-            for project in projects:
-                project.update_actual(api_key, hookset)
-        except Membership.DoesNotExist as e:
-            pass
+    def get_import_units():
+        """
+        Returns one unit of work per team and provider, however many of
+        the team's members have connected that provider. The team
+        creator's credentials are preferred, as in ProjectUpdateActualTimeView.
+        Invited members who haven't joined yet are left out.
+        """
+        units = OrderedDict()
+        memberships = Membership.objects.filter(state=Membership.STATE_JOINED,
+                                                user__profile__isnull=False).filter(
+            ~Q(user__profile__harvest_access_token='') | ~Q(user__profile__toggl_api_key='')
+        ).select_related('team', 'user__profile').order_by('team_id', 'id')
+        for membership in memberships:
+            is_creator = membership.user_id == membership.team.creator_id
+            for provider in (ProviderProjectLink.HARVEST, ProviderProjectLink.TOGGL):
+                if not get_provider_credentials(membership.user.profile, provider):
+                    continue
+                key = (membership.team_id, provider)
+                if key not in units or is_creator:
+                    units[key] = ImportUnit(membership.team_id, provider, membership.user)
+        return list(units.values())
 
     def do(self):
-        harvest_users = UserProfile.objects.filter(
-            ~Q(harvest_access_token='')
-        )
+        # Imports are incremental, so once a week every project's
+        # hours are added up again from scratch.
+        reconcile = timezone.now().weekday() == settings.IMPORT_RECONCILE_WEEKDAY
 
-        for user_profile in harvest_users:
-            tokens = {
-                'access_token': user_profile.harvest_access_token,
-                'refresh_token': user_profile.harvest_refresh_token,
-                'tokens_last_refreshed_at': user_profile.harvest_tokens_last_refreshed_at
-            }
-            print(tokens)
-
-            self.update_projects(user_profile.user, tokens, harvest_hookset)
-
-        toggl_users = UserProfile.objects.filter(
-            ~Q(toggl_api_key='')
-        )
-
-        for user_profile in toggl_users:
-            api_key = user_profile.toggl_api_key
-
-            self.update_projects(user_profile.user, api_key, toggl_hookset)
+        # The imports themselves are run by the run_import_jobs
+        # workers, so adding workers shortens the import window
+        queued = 0
+        units = self.get_import_units()
+        for unit in units:
+            _, created = enqueue_team_import(unit.team_id, unit.provider, unit.user, reconcile)
+            queued += int(created)
+        return 'Queued {} team imports, {} were still queued or running.'.format(
+            queued, len(units) - queued)
 
 
 def format_decimal(num):
@@ -189,90 +191,86 @@ class WeeklyProgressCronJob(CronJobBase):
             return self.Status.UNDER
 
     @staticmethod
-    def update_project_weekly_hours(project):
+    def update_project_weekly_hours(project, week_start=None):
+        if week_start is None:
+            week_start = timezone.now().date() - timedelta(days=7)
+        week_start = WeeklyHours.week_containing(week_start)
+
         hours_diff = project.actual - project.last_weeks_hours
         weekly_hours = hours_diff if hours_diff > 0 else 0
         project.last_weeks_hours = project.actual
-
-        # Store last weeks hours into previous weeks hours
-        previous_weeks_hours = project.previous_weeks_hours
-        if previous_weeks_hours is None:
-            previous_weeks_hours = []
-
-        previous_weeks_hours.insert(0, [weekly_hours, timezone.now().strftime('%b %d')])
-        project.previous_weeks_hours = previous_weeks_hours
         project.save()
 
-        return previous_weeks_hours
+        # Store last weeks hours into previous weeks hours. If the report
+        # already ran this week, add to what was recorded then.
+        week, created = WeeklyHours.objects.get_or_create(project=project,
+                                                          week_start=week_start,
+                                                          defaults={'hours': weekly_hours})
+        if not created:
+            WeeklyHours.objects.filter(id=week.id).update(hours=F('hours') + weekly_hours)
+
+        return [[week.hours, week.label] for week in project.weekly_hours.order_by('-week_start')]
 
     @staticmethod
     def get_team_weekly_hours(projects_data):
-        projects_previous_hours = []
-        projects_previous_dates = []
+        project_ids = [project_data['id'] for project_data in projects_data]
+        weeks = list(WeeklyHours.objects.filter(project_id__in=project_ids)
+                     .values('week_start')
+                     .annotate(total_hours=Sum('hours'))
+                     .order_by('-week_start'))
 
-        for project_data in projects_data:
-            if 'previous_weeks_hours' not in project_data:
-                continue
-            previous_weeks_hours = project_data['previous_weeks_hours']
-            project_hours = []
-            for hours in previous_weeks_hours:
-                project_hours.append(hours[0])
-                if hours[1] not in projects_previous_dates:
-                    projects_previous_dates.append(hours[1])
-            projects_previous_hours.append(project_hours)
+        return ([week['total_hours'] for week in weeks],
+                [WeeklyHours.label_for(week['week_start']) for week in weeks])
 
-        return [sum(x) for x in itertools.zip_longest(*projects_previous_hours, fillvalue=0)], projects_previous_dates
+    def get_projects_data_for_team(self, team):
+        # Newest projects first. Removing archived projects may lead
+        # to negative numbers, so they're left out of the email later.
+        projects = team.projects.with_item_status_counts().order_by('-id')
+
+        projects_data = []
+        for project in projects:
+            estimated = project.estimated
+            actual = project.actual
+            items_under, items_close, items_over = project.items_under, project.items_close, project.items_over
+            projects_data.append({
+                "name": project.name,
+                "archived": project.archived,
+                "estimated": estimated,
+                "actual": actual,
+                "hours_diff": estimated - actual,
+                "status": self.get_status(estimated=estimated, actual=actual),
+                "id": project.id,
+                "items_under": '{} item{} under'.format(items_under, '' if items_under == 1 else 's'),
+                "items_close": '{} item{} close'.format(items_close, '' if items_close == 1 else 's'),
+                "items_over": '{} item{} over'.format(items_over, '' if items_over == 1 else 's')
+            })
+        return projects_data
 
-    @transaction.atomic
     def get_projects_data_for_user(self, user):
         try:
-            membership = Membership.objects.get(user=user)
-
-            # Get all projects projects
-            projects = membership.team.projects.all()
-
-            # Removing archived projects may lead to negative numbers
-            # projects = membership.team.projects.filter(archived=False)
-            projects_data = []
-            for project in projects:
-                project_data = {}
-
-                project_data["previous_weeks_hours"] = project.previous_weeks_hours
-                project_data["name"] = project.name
-                project_data["archived"] = project.archived
-
-                estimated = project.estimated
-                actual = project.actual
-
-                project_data["estimated"] = estimated
-                project_data["actual"] = actual
-                project_data["hours_diff"] = estimated - actual
-                project_data["status"] = self.get_status(estimated=estimated, actual=actual)
-                project_data["id"] = project.id
-
-                items_under = 0
-                items_close = 0
-                items_over = 0
-                for category in project.categories.all():
-                    for item in category.items.all():
-                        item_status = self.get_status(estimated=item.estimated, actual=item.actual)
-                        if item_status is self.Status.UNDER:
-                            items_under += 1
-                        elif item_status is self.Status.CLOSE:
-                            items_close += 1
-                        else:
-                            items_over += 1
-
-                project_data["items_under"] = '{} item{} under'.format(items_under, '' if items_under == 1 else 's')
-                project_data["items_close"] = '{} item{} close'.format(items_close, '' if items_close == 1 else 's')
-                project_data["items_over"] = '{} item{} over'.format(items_over, '' if items_over == 1 else 's')
-
-                projects_data.append(project_data)
-
-            return projects_data
-        except Exception as e:
-            print(e)
+            membership = Membership.objects.select_related('team').get(user=user)
+        except (Membership.DoesNotExist, Membership.MultipleObjectsReturned):
             return []
+        return self.get_projects_data_for_team(membership.team)
+
+    def get_team_report(self, team):
+        """
+        Returns the total hours, history and projects of the team's
+        weekly email, or None when it shouldn't get one.
+        """
+        projects_data = self.get_projects_data_for_team(team)
+        team_previous_hours = self.get_team_weekly_hours(projects_data)
+
+        if len(team_previous_hours[0]) == 0:
+            return None
+
+        # If the team has not tracked any hours this week, don't send an email
+        if team_previous_hours[0][0] == 0:
+            return None
+
+        return (format_decimal(team_previous_hours[0][0]),
+                self.generate_weekly_history_substitutions(team_previous_hours),
+                self.generate_projects_substitutions(projects_data))
 
     def generate_weekly_history_substitutions(self, previous_weeks_hours):
         length = 4 if len(previous_weeks_hours[1]) > 4 else len(previous_weeks_hours[1])
@@ -380,7 +378,6 @@ class WeeklyProgressCronJob(CronJobBase):
     def do(self):
         if not self.is_monday():
             return
-        users = UserModel.objects.all()
 
         report_start = date.today() - timedelta(days=7)
         report_end = date.today()
@@ -388,34 +385,22 @@ class WeeklyProgressCronJob(CronJobBase):
         date_range = '%s - %s' % (report_start.strftime('%B %d'), report_end.strftime('%B %d'))
 
         self.update_all_projects()
-        for user in users:
-            # Check if user has a profile and wants weekly emails
-            try:
-                if not user.profile.wants_weekly_emails:
-                    continue
-            except ObjectDoesNotExist:
-                continue
-
-            projects_data = self.get_projects_data_for_user(user)
-            name = user.first_name
-            email = user.email
-
-            team_previous_hours = self.get_team_weekly_hours(projects_data)
 
-            if len(team_previous_hours[0]) == 0:
+        # Each team's report is put together once and sent to all of
+        # its members who want weekly emails
+        memberships = Membership.objects.filter(state=Membership.STATE_JOINED,
+                                                user__profile__wants_weekly_emails=True) \
+            .select_related('team', 'user').order_by('team_id', 'id')
+        for team, team_memberships in itertools.groupby(memberships, key=lambda membership: membership.team):
+            report = self.get_team_report(team)
+            if report is None:
                 continue
-
-            # If the team has not tracked any hours this week, don't send an email
-            if team_previous_hours[0][0] == 0:
-                continue
-            total_hours = format_decimal(team_previous_hours[0][0])
-
-            history = self.generate_weekly_history_substitutions(team_previous_hours)
-            projects_substitutions = self.generate_projects_substitutions(projects_data)
-
-            self.send_email(email=email,
-                            name=name,
-                            date=date_range,
-                            total_hours=total_hours,
-                            history=history,
-                            projects=projects_substitutions)
+            total_hours, history, projects_substitutions = report
+
+            for membership in team_memberships:
+                self.send_email(email=membership.user.email,
+                                name=membership.user.first_name,
+                                date=date_range,
+                                total_hours=total_hours,
+                                history=history,
+                                projects=projects_substitutions)
@@ -268,6 +268,56 @@ HARVEST_CLIENT_ID = os.environ.get('HARVEST_CLIENT_ID')
 
 HARVEST_CLIENT_SECRET = os.environ.get('HARVEST_CLIENT_SECRET')
 
+HARVEST_PER_PAGE = int(os.environ.get('HARVEST_PER_PAGE', 100))
+
+
+# Toggl and Harvest HTTP Settings (see albatross_api.transport)
+
+PROVIDER_HTTP_BACKOFF = float(os.environ.get('PROVIDER_HTTP_BACKOFF', 0.5))
+
+PROVIDER_HTTP_CONNECT_TIMEOUT = float(os.environ.get('PROVIDER_HTTP_CONNECT_TIMEOUT', 5))
+
+PROVIDER_HTTP_MAX_RETRIES = int(os.environ.get('PROVIDER_HTTP_MAX_RETRIES', 3))
+
+PROVIDER_HTTP_POOL_SIZE = int(os.environ.get('PROVIDER_HTTP_POOL_SIZE', 10))
+
+PROVIDER_HTTP_READ_TIMEOUT = float(os.environ.get('PROVIDER_HTTP_READ_TIMEOUT', 30))
+
+# Toggl allows about one request per second per API token. Detailed
+# report pages are fetched by up to TOGGL_REPORT_WORKERS threads at once,
+# spaced out to that rate, so slow pages overlap.
+TOGGL_REQUESTS_PER_SECOND = float(os.environ.get('TOGGL_REQUESTS_PER_SECOND', 1))
+
+TOGGL_REPORT_WORKERS = int(os.environ.get('TOGGL_REPORT_WORKERS', 4))
+
+
+# Import Settings (see projects.imports)
+
+# Entries older than this are assumed not to change between imports
+IMPORT_SETTLE_DAYS = int(os.environ.get('IMPORT_SETTLE_DAYS', 7))
+
+# Day of the week (Monday is 0) the nightly import rescans every project
+IMPORT_RECONCILE_WEEKDAY = int(os.environ.get('IMPORT_RECONCILE_WEEKDAY', 6))
+
+# How often the run_import_jobs workers check for queued imports
+IMPORT_JOB_POLL_SECONDS = float(os.environ.get('IMPORT_JOB_POLL_SECONDS', 2))
+
+# How long a worker's claim on an import lasts, unless its heartbeat
+# extends it, and how often the heartbeat does. An import whose worker
+# died is claimed by another once the lease runs out.
+IMPORT_JOB_LEASE_SECONDS = int(os.environ.get('IMPORT_JOB_LEASE_SECONDS', 15 * 60))
+IMPORT_JOB_HEARTBEAT_SECONDS = int(os.environ.get('IMPORT_JOB_HEARTBEAT_SECONDS', 5 * 60))
+
+# How many times an import is tried before it's marked as failed, and
+# how long to wait before trying it again, doubled after every attempt
+IMPORT_JOB_MAX_ATTEMPTS = int(os.environ.get('IMPORT_JOB_MAX_ATTEMPTS', 3))
+IMPORT_JOB_RETRY_DELAY_SECONDS = int(os.environ.get('IMPORT_JOB_RETRY_DELAY_SECONDS', 60))
+
+# How many of the nightly team imports may be importing from each
+# provider at the same time, across all workers
+HARVEST_IMPORT_CONCURRENCY = int(os.environ.get('HARVEST_IMPORT_CONCURRENCY', 2))
+TOGGL_IMPORT_CONCURRENCY = int(os.environ.get('TOGGL_IMPORT_CONCURRENCY', 2))
+
 
 # DRF Stripe Settings
 
@@ -328,3 +378,23 @@ CACHES = {
         'LOCATION': 'django_cache',
     }
 }
+
+
+# Logging Settings
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # Logs the project list cache's hit rate now and then
+        'projects.cache': {
+            'handlers': ['console'],
+            'level': os.environ.get('PROJECT_LIST_CACHE_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
@@ -1,20 +1,24 @@
 import mock
+import requests
 import unittest
 
 from decimal import Decimal
 from mock import MagicMock
 
-from datetime import timedelta
+from datetime import date, datetime, timedelta
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 from harvest.utils import TokensManager
 from authentication.models import UserProfile
 
-from teams.models import Team
-from projects.models import Project, Category, Item
+from teams.models import Membership, Team
+from projects.jobs import PROVIDER_HOOKSETS, run_import_jobs
+from projects.models import Project, Category, ImportJob, Item, ProviderProjectLink, WeeklyHours
 
-from .cron import RefreshHarvestTokensCronJob, TrailExpirationCronJob, ImportHoursCronJob, WeeklyProgressCronJob
+from . import transport
+from .cron import (RefreshHarvestTokensCronJob, TrailExpirationCronJob, ImportHoursCronJob, ImportUnit,
+                   WeeklyProgressCronJob)
 
 
 class RefreshHarvestTokensCronJobTestCase(TestCase):
@@ -162,6 +166,68 @@ class ImportHoursCronJobTestCase(TestCase):
         cronjob = ImportHoursCronJob()
         cronjob.do()
 
+    def create_user(self, email, toggl_api_key='', harvest_access_token=''):
+        user = User.objects.create_user(email=email, password='password125', username=email)
+        user.profile.toggl_api_key = toggl_api_key
+        user.profile.harvest_access_token = harvest_access_token
+        user.profile.save()
+        return user
+
+    @override_settings(IMPORT_JOB_RETRY_DELAY_SECONDS=0)
+    def test_each_team_is_imported_once_per_provider(self):
+        creator = self.create_user('creator@example.com', toggl_api_key='creator')
+        team = Team.objects.create(creator=creator, name='Team')
+        for email in ('member.1@example.com', 'member.2@example.com'):
+            Membership.objects.create(team=team, user=self.create_user(email, toggl_api_key=email),
+                                      state=Membership.STATE_JOINED)
+        Project.objects.create(name='Current', team=team)
+        Project.objects.create(name='Archived', team=team, archived=True)
+        harvest_team = Team.objects.create(creator=self.create_user('harvest@example.com', harvest_access_token='abc'),
+                                           name='Harvest Team')
+
+        self.assertEqual(ImportHoursCronJob().do(), 'Queued 2 team imports, 0 were still queued or running.')
+        self.assertEqual(ImportHoursCronJob().do(), 'Queued 0 team imports, 2 were still queued or running.')
+
+        # The hooksets are called with self=hookset, which MagicMock won't take
+        toggl_imports = []
+        harvest_imports = []
+
+        def import_from_toggl(**kwargs):
+            toggl_imports.append(kwargs)
+            return 2
+
+        def import_from_harvest(**kwargs):
+            harvest_imports.append(kwargs)
+            raise ValueError('Harvest is down')
+
+        with mock.patch.dict(PROVIDER_HOOKSETS, {
+            ProviderProjectLink.HARVEST: MagicMock(update_team_line_item_times=import_from_harvest),
+            ProviderProjectLink.TOGGL: MagicMock(update_team_line_item_times=import_from_toggl)
+        }):
+            run_import_jobs()
+
+        self.assertEqual(len(toggl_imports), 1)
+        self.assertEqual(toggl_imports[0]['api_credentials'], 'creator')
+        self.assertEqual([project.name for project in toggl_imports[0]['projects']], ['Current'])
+        self.assertEqual(ImportJob.objects.get(team=team).changed_items, 2)
+
+        # Failed imports are tried again, up to IMPORT_JOB_MAX_ATTEMPTS times
+        self.assertEqual(len(harvest_imports), 3)
+        self.assertEqual(harvest_imports[0]['api_credentials']['access_token'], 'abc')
+        harvest_job = ImportJob.objects.get(team=harvest_team)
+        self.assertEqual(harvest_job.status, ImportJob.FAILED)
+        self.assertEqual(harvest_job.error, 'Harvest is down')
+
+    def test_invited_members_credentials_are_not_used(self):
+        team = Team.objects.create(creator=self.create_user('creator@example.com'), name='Team')
+        Membership.objects.create(team=team, user=self.create_user('invited@example.com', toggl_api_key='invited'),
+                                  state=Membership.STATE_INVITED)
+        joined = self.create_user('joined@example.com', harvest_access_token='abc')
+        Membership.objects.create(team=team, user=joined, state=Membership.STATE_JOINED)
+
+        self.assertEqual(ImportHoursCronJob.get_import_units(),
+                         [ImportUnit(team.id, ProviderProjectLink.HARVEST, joined)])
+
 
 class WeeklyProgressCronJobTestCase(TestCase):
     CATEGORY_NAME = 'Frontend'
@@ -188,9 +254,26 @@ class WeeklyProgressCronJobTestCase(TestCase):
         project = Project.objects.get(name=self.PROJECT_NAME)
         hours = cronjob.update_project_weekly_hours(project)
 
-        self.assertEqual(hours[0], [Decimal(49), timezone.now().strftime('%b %d')])
+        last_week = WeeklyHours.week_containing(timezone.now().date() - timedelta(days=7))
+        self.assertEqual(hours[0], [Decimal(49), WeeklyHours.label_for(last_week)])
         self.assertEqual(project.actual, project.last_weeks_hours)
 
+    def test_weekly_hours_on_different_weekdays(self):
+        cronjob = WeeklyProgressCronJob()
+        project = Project.objects.get(name=self.PROJECT_NAME)
+        tuesday = timezone.make_aware(datetime(2026, 10, 13, 9))
+        with mock.patch('albatross_api.cron.timezone.now', return_value=tuesday):
+            cronjob.update_project_weekly_hours(project)
+
+        Item.objects.create(description='New item', actual=4, estimated=20, category=project.categories.get())
+        project.refresh_from_db()
+        # Running the report again later in the same week adds to that week
+        with mock.patch('albatross_api.cron.timezone.now', return_value=tuesday + timedelta(days=3)):
+            hours = cronjob.update_project_weekly_hours(project)
+
+        self.assertEqual(hours, [[Decimal(53), 'Oct 12']])
+        self.assertEqual(project.weekly_hours.get().week_start, date(2026, 10, 5))
+
     def test_generate_projects_substitutions(self):
         user = User.objects.get(email='kehoffman3@gmail.com')
         team = Team.objects.get(name='Kritters', creator=user)
@@ -256,7 +339,8 @@ class WeeklyProgressCronJobTestCase(TestCase):
         substitutions = cronjob.generate_weekly_history_substitutions(previous_hours)
         current_week_substitutions = substitutions[0]
         self.assertEqual('100%', current_week_substitutions['height'])
-        self.assertEqual(timezone.now().strftime('%b %d'), current_week_substitutions['date'])
+        last_week = WeeklyHours.week_containing(timezone.now().date() - timedelta(days=7))
+        self.assertEqual(WeeklyHours.label_for(last_week), current_week_substitutions['date'])
 
         last_week_substitutions = substitutions[1]
         self.assertEqual('27%', last_week_substitutions['height'])
@@ -315,23 +399,29 @@ class WeeklyProgressCronJobTestCase(TestCase):
         project = Project.objects.create(name='Project', team=team)
         category = Category.objects.create(name='Category', project=project)
         item = Item.objects.create(description='Item', actual=24, estimated=25, category=category)
+        three_weeks_ago = WeeklyHours.week_containing(timezone.now().date() - timedelta(days=21))
+        two_weeks_ago = WeeklyHours.week_containing(timezone.now().date() - timedelta(days=14))
+        last_week = WeeklyHours.week_containing(timezone.now().date() - timedelta(days=7))
 
         cronjob = WeeklyProgressCronJob()
-        cronjob.update_all_projects()
+        for project_to_update in Project.objects.all():
+            cronjob.update_project_weekly_hours(project_to_update, week_start=three_weeks_ago)
         projects_data = cronjob.get_projects_data_for_user(user)
         team_previous_hours = cronjob.get_team_weekly_hours(projects_data)
 
-        self.assertEqual(team_previous_hours, ([73], [timezone.now().strftime('%b %d')]))
+        self.assertEqual(team_previous_hours, ([73], [WeeklyHours.label_for(three_weeks_ago)]))
 
         Item.objects.create(description='New Item', actual=11, estimated=25, category=category)
         item.actual = 35
         item.save()
 
-        cronjob.update_all_projects()
+        for project_to_update in Project.objects.all():
+            cronjob.update_project_weekly_hours(project_to_update, week_start=two_weeks_ago)
         new_projects_data = cronjob.get_projects_data_for_user(user)
         new_team_previous_hours = cronjob.get_team_weekly_hours(new_projects_data)
 
-        self.assertEqual(new_team_previous_hours, ([22, 73], [timezone.now().strftime('%b %d')]))
+        self.assertEqual(new_team_previous_hours, ([22, 73], [WeeklyHours.label_for(two_weeks_ago),
+                                                              WeeklyHours.label_for(three_weeks_ago)]))
 
         project = Project.objects.create(name='Another Project', team=team)
         new_category = Category.objects.create(name='Another Category', project=project)
@@ -346,8 +436,16 @@ class WeeklyProgressCronJobTestCase(TestCase):
         cronjob.update_all_projects()
         third_projects_data = cronjob.get_projects_data_for_user(user)
         third_team_previous_hours = cronjob.get_team_weekly_hours(third_projects_data)
-        self.assertEqual(third_team_previous_hours, ([11, 22, 73], [timezone.now().strftime('%b %d')]))
+        self.assertEqual(third_team_previous_hours, ([11, 22, 73], [WeeklyHours.label_for(last_week),
+                                                                    WeeklyHours.label_for(two_weeks_ago),
+                                                                    WeeklyHours.label_for(three_weeks_ago)]))
 
+        # Running the report twice in a week adds to that week's hours
+        item.actual = 45
+        item.save()
+        cronjob.update_all_projects()
+        fourth_team_previous_hours = cronjob.get_team_weekly_hours(third_projects_data)
+        self.assertEqual(fourth_team_previous_hours[0], [16, 22, 73])
 
     @mock.patch('albatross_api.cron.WeeklyProgressCronJob.send_email')
     @mock.patch('albatross_api.cron.WeeklyProgressCronJob.is_monday')
@@ -446,7 +544,89 @@ class WeeklyProgressCronJobTestCase(TestCase):
         self.assertEqual('25', project_substitutions['estimated'])
         self.assertEqual('24', project_substitutions['actual'])
 
+    def test_item_status_counts_match_get_status(self):
+        user = User.objects.get(email='kehoffman3@gmail.com')
+        project = Project.objects.create(name='Boundaries', team=Team.objects.get(name='Kritters', creator=user))
+        category = Category.objects.create(name='Category', project=project)
+        for actual, estimated in ((9, 10), (8.99, 10), (10, 10), (10.01, 10), (0, 0), (1, 0)):
+            Item.objects.create(description='Item', actual=actual, estimated=estimated, category=category)
+
+        cronjob = WeeklyProgressCronJob()
+        statuses = [cronjob.get_status(estimated=item.estimated, actual=item.actual)
+                    for item in Item.objects.filter(category=category).order_by('id')]
+        expected = tuple(statuses.count(status)
+                         for status in (cronjob.Status.UNDER, cronjob.Status.CLOSE, cronjob.Status.OVER))
+        self.assertEqual(expected, (2, 2, 2))
+        project = Project.objects.with_item_status_counts().get(pk=project.pk)
+        self.assertEqual((project.items_under, project.items_close, project.items_over), expected)
+        self.assertEqual([item.status for item in Item.objects.filter(category=category).with_status().order_by('id')],
+                         [status.name.lower() for status in statuses])
+
+    @mock.patch('albatross_api.cron.WeeklyProgressCronJob.send_email')
+    @mock.patch('albatross_api.cron.WeeklyProgressCronJob.is_monday')
+    def test_report_is_built_once_per_team(self, mock_is_monday, mock_send_email):
+        mock_is_monday.return_value = True
+        team = Team.objects.get(name='Kritters')
+        for email, wants_weekly_emails in (('member.1@example.com', True), ('member.2@example.com', False)):
+            member = User.objects.create_user(email=email, first_name=email, password='password125', username=email)
+            member.profile.wants_weekly_emails = wants_weekly_emails
+            member.profile.save()
+            Membership.objects.create(team=team, user=member, state=Membership.STATE_JOINED)
 
+        cronjob = WeeklyProgressCronJob()
+        with mock.patch.object(cronjob, 'get_projects_data_for_team',
+                               wraps=cronjob.get_projects_data_for_team) as get_projects_data:
+            cronjob.do()
 
+        get_projects_data.assert_called_once_with(team)
+        self.assertEqual([call[1]['email'] for call in mock_send_email.call_args_list],
+                         ['kehoffman3@gmail.com', 'member.1@example.com'])
+        self.assertEqual(mock_send_email.call_args_list[0][1]['projects'],
+                         mock_send_email.call_args_list[1][1]['projects'])
 
 
+class TransportTestCase(TestCase):
+    def setUp(self):
+        transport.reset_stats()
+
+    def test_sessions_are_pooled_per_host(self):
+        session = transport.get_session('https://toggl.com/reports/api/v2/details')
+        self.assertIs(session, transport.get_session('https://toggl.com/api/v8/me'))
+        self.assertIsNot(session, transport.get_session('https://api.harvestapp.com/v2/projects'))
+        self.assertEqual(session.get_adapter('https://toggl.com').max_retries.total, 3)
+
+    def test_endpoint_leaves_out_ids(self):
+        self.assertEqual(transport.get_endpoint('https://www.toggl.com/api/v8/clients/42/projects?x=1'),
+                         'www.toggl.com/api/v8/clients/:id/projects')
+
+    @mock.patch('albatross_api.transport.get_session')
+    def test_request_sets_timeouts_and_records_stats(self, mock_get_session):
+        mock_get_session.return_value.request.return_value = MagicMock(status_code=200, content=b'{"data": []}')
+
+        transport.get('https://www.toggl.com/api/v8/clients/1/projects')
+        transport.get('https://www.toggl.com/api/v8/clients/2/projects')
+
+        kwargs = mock_get_session.return_value.request.call_args[1]
+        self.assertEqual(kwargs['timeout'], (5, 30))
+        stats = transport.get_stats()['www.toggl.com/api/v8/clients/:id/projects']
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(stats['bytes'], 24)
+
+    @mock.patch('albatross_api.transport.get_session')
+    def test_request_records_connection_errors(self, mock_get_session):
+        mock_get_session.return_value.request.side_effect = requests.ConnectionError()
+
+        with self.assertRaises(requests.ConnectionError):
+            transport.get('https://api.harvestapp.com/v2/time_entries')
+        self.assertEqual(transport.get_stats()['api.harvestapp.com/v2/time_entries']['errors'], 1)
+
+    @mock.patch('albatross_api.transport.time.sleep')
+    def test_rate_limiter_spaces_out_calls(self, mock_sleep):
+        rate_limiter = transport.RateLimiter(2)
+        for _ in range(3):
+            rate_limiter.wait()
+        delays = [call[0][0] for call in mock_sleep.call_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertAlmostEqual(delays[0], 0.5, places=1)
+        self.assertAlmostEqual(delays[1], 1, places=1)
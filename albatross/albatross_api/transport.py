@@ -0,0 +1,121 @@
+"""
+HTTP transport shared by the Toggl and Harvest clients.
+
+Requests reuse one pooled session per host, always have connect and read
+timeouts, and are retried a bounded number of times with exponential
+backoff on connection errors and 429/5xx responses. Every request is
+recorded in per-endpoint latency and byte counters, which are kept per
+process and can be read with get_stats().
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_session(url):
+    host = urlsplit(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            # Only idempotent methods are retried on a bad status
+            retry = Retry(total=settings.PROVIDER_HTTP_MAX_RETRIES,
+                          backoff_factor=settings.PROVIDER_HTTP_BACKOFF,
+                          status_forcelist=RETRY_STATUSES,
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=settings.PROVIDER_HTTP_POOL_SIZE,
+                                  max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[host] = session
+    return session
+
+
+def get_endpoint(url):
+    # Ids are left out so e.g. every client's projects share one endpoint
+    parts = urlsplit(url)
+    return '{}{}'.format(parts.netloc, re.sub(r'/\d+(?=/|$)', '/:id', parts.path))
+
+
+def record(endpoint, seconds, response_bytes, error=False):
+    with _stats_lock:
+        stats = _stats.setdefault(endpoint, OrderedDict([
+            ('requests', 0),
+            ('errors', 0),
+            ('seconds', 0.0),
+            ('max_seconds', 0.0),
+            ('bytes', 0)
+        ]))
+        stats['requests'] += 1
+        stats['errors'] += int(error)
+        stats['seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        stats['bytes'] += response_bytes
+
+
+def get_stats():
+    with _stats_lock:
+        return {endpoint: dict(stats) for endpoint, stats in _stats.items()}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls to wait() so no more than `rate` of them return per
+    second, across all the threads sharing the limiter.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def request(method, url, endpoint=None, **kwargs):
+    kwargs.setdefault('timeout', (settings.PROVIDER_HTTP_CONNECT_TIMEOUT,
+                                  settings.PROVIDER_HTTP_READ_TIMEOUT))
+    endpoint = endpoint or get_endpoint(url)
+    started_at = time.monotonic()
+    try:
+        response = get_session(url).request(method, url, **kwargs)
+    except requests.RequestException:
+        record(endpoint, time.monotonic() - started_at, 0, error=True)
+        raise
+    record(endpoint, time.monotonic() - started_at, len(response.content),
+           error=response.status_code >= 400)
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
@@ -1,6 +1,6 @@
 import json
 
-import requests
+from albatross_api import transport
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -83,7 +83,7 @@ class UserProfileHarvestView(GenericAPIView):
             client_secret=settings.HARVEST_CLIENT_SECRET
         )
         headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'}
-        resp = requests.post('https://id.getharvest.com/api/v1/oauth2/token', headers=headers, data=body, verify=False)
+        resp = transport.post('https://id.getharvest.com/api/v1/oauth2/token', headers=headers, data=body, verify=False)
         if resp.status_code >= 400:
             raise ValidationError("Failed to retrieve Harvest tokens")
         return json.loads(resp.content.decode())
@@ -1,89 +1,157 @@
-from datetime import datetime
+from collections import defaultdict
+from decimal import Decimal
 
 from django.conf import settings
-from django.db import transaction
-from django.utils import timezone
+from django.utils.dateparse import parse_date
+from projects.imports import finish_import, get_import_window
+from projects.models import ProviderProjectLink, TimeEntry
 
 from .utils import Harvest
 
 
-def make_item_key(item):
-    return "{}:{}".format(item.category.name.lower(),
-                          item.description.lower())
+def get_harvest(api_credentials):
+    return Harvest(access_token=api_credentials['access_token'],
+                   account_id=api_credentials.get('account_id', None),
+                   client_id=settings.HARVEST_CLIENT_ID,
+                   client_secret=settings.HARVEST_CLIENT_SECRET,
+                   refresh_token=api_credentials.get('refresh_token', None),
+                   tokens_last_refreshed_at=api_credentials.get('tokens_last_refreshed_at', None))
+
+
+def find_harvest_project(harvest, project):
+    """
+    Returns the Harvest project that the project imports its hours from.
+    The stored link is used when it still points at a project with the
+    same name, otherwise the project is looked up by name and linked.
+    """
+    link = project.provider_links.filter(provider=ProviderProjectLink.HARVEST).first()
+    if link is not None:
+        harvest_project = harvest.project(link.provider_project_id)
+        if harvest_project is not None and getattr(harvest_project, 'name', None) == project.name:
+            return harvest_project
+
+    # Right now we are assuming that every project has a unique name
+    for harvest_project in harvest.projects():
+        if harvest_project.name == project.name:
+            ProviderProjectLink.link(project, ProviderProjectLink.HARVEST, harvest_project.id)
+            return harvest_project
+    return None
+
+
+class TaskNames(object):
+    """
+    Resolves the task names of a project's time entries without a request
+    per entry. Entries normally embed their task's name; for any that
+    don't, the project's task assignments are read once, in bulk.
+    """
+
+    def __init__(self, harvest_project):
+        self.harvest_project = harvest_project
+        self.names = None
+
+    def get(self, time_entry):
+        name = time_entry.task_name
+        if name is not None:
+            return name
+        if self.names is None:
+            self.names = {task_assignment._task['id']: task_assignment._task['name']
+                          for task_assignment in self.harvest_project.task_assignments}
+        return self.names.get(time_entry._task['id'], '')
+
+
+def make_time_entry(time_entry, task_names):
+    return TimeEntry(category_name=task_names.get(time_entry),
+                     description=time_entry.notes or '',
+                     hours=Decimal(str(time_entry.hours)),
+                     provider_entry_id=time_entry.id,
+                     spent_on=parse_date(time_entry.spent_date))
 
 
 class HarvestDefaultHookset(object):
 
-    @transaction.atomic
-    def update_project_line_item_times(self, api_credentials, project_to_update):
+    def update_project_line_item_times(self, api_credentials, project_to_update, reconcile=False):
         if not project_to_update.categories.all().exists():
-            return
-
-        harvest = Harvest(access_token=api_credentials['access_token'],
-                          account_id=api_credentials.get('account_id', None),
-                          client_id=settings.HARVEST_CLIENT_ID,
-                          client_secret=settings.HARVEST_CLIENT_SECRET,
-                          refresh_token=api_credentials.get('refresh_token', None),
-                          tokens_last_refreshed_at=api_credentials.get('tokens_last_refreshed_at', None))
-
-        # Right now we are assuming that every project has a unique name
-        # Note: Toggl requires a workspace id to get a detailed report
-        # so we need to grab the one associated with the project
-        harvest_project = None
-        for project in harvest.projects():
-            if project.name == project_to_update.name:
-                harvest_project = project
-                break
+            return 0
+
+        harvest = get_harvest(api_credentials)
+
+        harvest_project = find_harvest_project(harvest, project_to_update)
         if harvest_project is None:
-            return
-
-        # Get tasks that correspond to our categories
-        all_tasks = harvest_project.task_assignments
-        project_to_update_categories = project_to_update.categories.all()
-        category_names = {category.name.lower() for category
-                          in project_to_update_categories}
-        ids_for_tasks_that_match_categories = []
-        for task_data in all_tasks:
-            task = task_data.task
-            if task.name.lower() in category_names:
-                ids_for_tasks_that_match_categories.append(task.id)
-
-        # Grab all the time entires over the past year
-        # for the project we want to update
-        time_entries = project.entries()
-
-        # Add up the durations for all of the line items
-        # whose descriptions match the descriptions of our
-        # project's line items.
-        project_to_update_line_items = []
-        for category in project_to_update_categories:
-            line_items = category.items.all()
-            if line_items.exists():
-                project_to_update_line_items += list(line_items)
-        if not project_to_update_line_items:
-            return
-
-        line_items = {make_item_key(item) : item for item
-                      in project_to_update_line_items}
-        line_item_totals = {make_item_key(item): 0
-                            for item in project_to_update_line_items}
-
-        for time_entry in time_entries:
-            time_entry_task_name = time_entry.task.name.lower()
-            item_key = "{}:{}".format(time_entry_task_name,
-                                      time_entry.notes.lower())
-            if item_key in line_item_totals:
-                total = line_item_totals[item_key]
-                total+= time_entry.hours
-                line_item_totals[item_key] = total
-
-        for item_key, total in line_item_totals.items():
-            line_item = line_items[item_key]
-            line_item.actual = total
-            line_item.save()
-
-        project_to_update.last_imported_date = timezone.make_aware(datetime.now())
-        project_to_update.save()
+            return 0
+
+        # Grab the time entries since the last import, or all of
+        # them when everything has to be added up again
+        since = get_import_window(project_to_update, reconcile)
+        task_names = TaskNames(harvest_project)
+        time_entries = [make_time_entry(time_entry, task_names)
+                        for time_entry in harvest_project.entries(start=since)]
+        return finish_import(project_to_update, ProviderProjectLink.HARVEST, time_entries, since)
+
+    def update_team_line_item_times(self, api_credentials, projects, reconcile=False):
+        """
+        Imports every one of a team's projects with one Harvest client.
+        The account's projects are listed once. A stored link is used when
+        it still points at a project with the same name, as in
+        find_harvest_project, otherwise the project is looked up by name
+        and linked again, or skipped when there's none. The entries of
+        projects imported before are fetched in one sweep and split up by
+        project, while projects that need their whole history are fetched
+        on their own. Returns the number of items whose actual hours changed.
+        """
+        projects = projects.filter(categories__isnull=False).distinct()
+        if not projects:
+            return 0
+
+        harvest = get_harvest(api_credentials)
+
+        linked_ids = dict(
+            ProviderProjectLink.objects.filter(project__in=projects, provider=ProviderProjectLink.HARVEST)
+            .values_list('project_id', 'provider_project_id'))
+        harvest_projects = {}
+        harvest_projects_by_name = {}
+        for harvest_project in harvest.projects():
+            harvest_projects[harvest_project.id] = harvest_project
+            # Right now we are assuming that every project has a unique name
+            harvest_projects_by_name.setdefault(harvest_project.name, harvest_project)
+
+        # Harvest project id -> [(project, since)]
+        imports = defaultdict(list)
+        for project in projects:
+            harvest_project = harvest_projects.get(linked_ids.get(project.id))
+            if harvest_project is None or harvest_project.name != project.name:
+                harvest_project = harvest_projects_by_name.get(project.name)
+                if harvest_project is None:
+                    continue
+                ProviderProjectLink.link(project, ProviderProjectLink.HARVEST, harvest_project.id)
+            imports[harvest_project.id].append((project, get_import_window(project, reconcile)))
+        if not imports:
+            return 0
+
+        time_entries = defaultdict(list)
+        # Projects that need their whole history are fetched on their
+        # own, so they don't widen the sweep for the others
+        full_imports = {project_id for project_id, project_imports in imports.items()
+                        if any(since is None for _, since in project_imports)}
+        for project_id in full_imports:
+            time_entries[project_id] = list(harvest_projects[project_id].entries())
+        windows = [since for project_id, project_imports in imports.items()
+                   if project_id not in full_imports for _, since in project_imports]
+        if windows:
+            for time_entry in harvest._time_entries(start=min(windows)):
+                project_id = time_entry._project['id']
+                if project_id in imports and project_id not in full_imports:
+                    time_entries[project_id].append(time_entry)
+
+        changed = 0
+        for project_id, project_imports in imports.items():
+            task_names = TaskNames(harvest_projects[project_id])
+            for project, since in project_imports:
+                # Entries before the project's own window are already stored
+                project_entries = [make_time_entry(time_entry, task_names)
+                                   for time_entry in time_entries[project_id]
+                                   if since is None or parse_date(time_entry.spent_date) >= since]
+                changed += finish_import(project, ProviderProjectLink.HARVEST, project_entries, since)
+        return changed
 
 
 class HookProxy(object):
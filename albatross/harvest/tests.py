@@ -1,13 +1,15 @@
 from datetime import timedelta
 from decimal import Decimal
 from django.utils import timezone
+import mock
 
 from django.contrib.auth.models import User
-from django.test import TestCase
-from projects.models import Category, Item, Project
+from django.test import TestCase, override_settings
+from projects.models import Category, Item, Project, ProviderProjectLink, TimeEntry
 from teams.models import Team
 
-from .hooks import hookset
+from .hooks import TaskNames, find_harvest_project, hookset
+from .utils import Entry, Harvest, Project as HarvestProject, TaskAssignment
 
 
 class HarvestTestCase(TestCase):
@@ -98,3 +100,148 @@ class HarvestTestCase(TestCase):
         assert updated_project.actual > Decimal(19.5) # design is only thing in harvest
 
         assert (updated_project.last_imported_date - timezone.now() < timedelta(seconds=15))
+
+
+class HarvestProjectLinkTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='link@test.com', password='password125', username='link@test.com')
+        self.project = Project.objects.create(name='Website', team=Team.objects.create(name='Team', creator=user))
+        self.harvest = mock.MagicMock()
+        self.harvest_project = mock.MagicMock(id=12)
+        self.harvest_project.name = 'Website'
+
+    def test_first_import_links_the_project(self):
+        other_project = mock.MagicMock(id=11)
+        other_project.name = 'Other'
+        self.harvest.projects.return_value = iter([other_project, self.harvest_project])
+
+        self.assertIs(find_harvest_project(self.harvest, self.project), self.harvest_project)
+        link = ProviderProjectLink.objects.get(project=self.project, provider=ProviderProjectLink.HARVEST)
+        self.assertEqual(link.provider_project_id, 12)
+
+    def test_later_imports_skip_discovery(self):
+        ProviderProjectLink.link(self.project, ProviderProjectLink.HARVEST, 12)
+        self.harvest.project.return_value = self.harvest_project
+
+        self.assertIs(find_harvest_project(self.harvest, self.project), self.harvest_project)
+        self.harvest.project.assert_called_once_with(12)
+        self.harvest.projects.assert_not_called()
+
+
+@override_settings(HARVEST_PER_PAGE=2)
+class HarvestPaginationTestCase(TestCase):
+    def setUp(self):
+        self.harvest = Harvest(access_token='123', client_id='id', client_secret='secret', account_id=1)
+
+    def test_time_entries_follow_next_links(self):
+        pages = {
+            '/time_entries': {
+                'time_entries': [{'id': 1}, {'id': 2}],
+                'links': {'next': 'https://api.harvestapp.com/v2/time_entries?page=2&per_page=2'}
+            },
+            'https://api.harvestapp.com/v2/time_entries?page=2&per_page=2': {
+                'time_entries': [{'id': 3}],
+                'links': {'next': None}
+            }
+        }
+        with mock.patch.object(self.harvest, '_request', side_effect=lambda url, query_params: pages[url]) as request:
+            entries = self.harvest._time_entries(query_params={'project_id': 5})
+            self.assertEqual(request.call_count, 0)
+            self.assertEqual([entry.id for entry in entries], [1, 2, 3])
+
+        self.assertEqual(request.call_args_list[0][0][1], {'project_id': 5, 'per_page': 2})
+        self.assertEqual(request.call_args_list[1][0][1], {})
+
+
+class HarvestTaskNamesTestCase(TestCase):
+    def test_task_names_dont_fetch_tasks(self):
+        harvest = mock.MagicMock()
+        harvest_project = mock.MagicMock()
+        harvest_project.task_assignments = iter([
+            TaskAssignment(harvest, {'task': {'id': 2, 'name': 'Design'}})
+        ])
+        task_names = TaskNames(harvest_project)
+
+        self.assertEqual(task_names.get(Entry(harvest, {'task': {'id': 1, 'name': 'Backend'}})), 'Backend')
+        self.assertEqual(task_names.get(Entry(harvest, {'task': {'id': 2}})), 'Design')
+        self.assertEqual(task_names.get(Entry(harvest, {'task': {'id': 3}})), '')
+        harvest.task.assert_not_called()
+
+
+class HarvestTeamImportTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='team@test.com', password='password125', username='team@test.com')
+        self.team = Team.objects.create(name='Team', creator=user)
+        self.harvest = mock.MagicMock()
+        self.harvest_projects = []
+        for harvest_id, name in ((12, 'Website'), (13, 'App')):
+            project = Project.objects.create(name=name, team=self.team)
+            category = Category.objects.create(name='Design', project=project)
+            Item.objects.create(description='Mockups', actual=0, estimated=10, category=category)
+            self.harvest_projects.append(HarvestProject(self.harvest, {'id': harvest_id, 'name': name}))
+        self.harvest.projects.side_effect = lambda: iter(self.harvest_projects)
+        self.time_entries = [
+            Entry(self.harvest, {'id': 1, 'project': {'id': 12}, 'task': {'id': 1, 'name': 'Design'},
+                                 'notes': 'Mockups', 'hours': 2.5, 'spent_date': '2017-10-02'}),
+            Entry(self.harvest, {'id': 2, 'project': {'id': 13}, 'task': {'id': 1, 'name': 'Design'},
+                                 'notes': 'Mockups', 'hours': 1, 'spent_date': '2017-10-02'}),
+            Entry(self.harvest, {'id': 3, 'project': {'id': 14}, 'task': {'id': 1, 'name': 'Design'},
+                                 'notes': 'Mockups', 'hours': 4, 'spent_date': '2017-10-02'})
+        ]
+        self.harvest._time_entries.side_effect = self.get_time_entries
+
+    def get_time_entries(self, start=None, end=None, query_params=None):
+        project_id = (query_params or {}).get('project_id')
+        return iter([time_entry for time_entry in self.time_entries
+                     if project_id is None or time_entry._project['id'] == project_id])
+
+    def import_team(self, reconcile=False):
+        with mock.patch('harvest.hooks.Harvest', return_value=self.harvest):
+            return hookset.update_team_line_item_times(self=hookset, api_credentials={'access_token': '123'},
+                                                       projects=self.team.projects.all(), reconcile=reconcile)
+
+    def test_first_team_import_links_and_fetches_each_project(self):
+        self.import_team()
+
+        self.assertEqual(dict(ProviderProjectLink.objects.values_list('project__name', 'provider_project_id')),
+                         {'Website': 12, 'App': 13})
+        # Projects without stored entries need their whole history
+        self.harvest._time_entries.assert_has_calls([
+            mock.call(None, None, query_params={'project_id': 12}),
+            mock.call(None, None, query_params={'project_id': 13})
+        ], any_order=True)
+        self.assertEqual(self.harvest._time_entries.call_count, 2)
+        self.assertEqual(Item.objects.get(category__project__name='Website').actual, Decimal('2.5'))
+        self.assertEqual(Item.objects.get(category__project__name='App').actual, 1)
+
+    def test_team_import_sweeps_linked_projects_once(self):
+        self.import_team()
+        links_updated_at = dict(ProviderProjectLink.objects.values_list('pk', 'updated_at'))
+        self.harvest._time_entries.reset_mock()
+        self.time_entries.append(
+            Entry(self.harvest, {'id': 4, 'project': {'id': 12}, 'task': {'id': 1, 'name': 'Design'},
+                                 'notes': 'Mockups', 'hours': 0.5,
+                                 'spent_date': timezone.now().date().isoformat()}))
+
+        self.import_team()
+
+        self.assertEqual(self.harvest.projects.call_count, 2)
+        self.harvest._time_entries.assert_called_once_with(start=mock.ANY)
+        self.assertEqual(dict(ProviderProjectLink.objects.values_list('pk', 'updated_at')), links_updated_at)
+        self.assertEqual(Item.objects.get(category__project__name='Website').actual, 3)
+        self.assertEqual(Item.objects.get(category__project__name='App').actual, 1)
+
+    def test_stale_links_are_resolved_again(self):
+        self.import_team()
+        # Website's Harvest project was replaced by one with another id,
+        # and App's was deleted
+        self.harvest_projects[:] = [HarvestProject(self.harvest, {'id': 14, 'name': 'Website'})]
+
+        self.import_team(reconcile=True)
+
+        self.assertEqual(dict(ProviderProjectLink.objects.values_list('project__name', 'provider_project_id')),
+                         {'Website': 14, 'App': 13})
+        self.assertEqual(Item.objects.get(category__project__name='Website').actual, 4)
+        # Projects whose link can't be resolved are left alone
+        self.assertEqual(Item.objects.get(category__project__name='App').actual, 1)
+        self.assertTrue(TimeEntry.objects.filter(project__name='App').exists())
@@ -1,6 +1,8 @@
 import json, requests
 
+from albatross_api import transport
 from dateutil.parser import parse as parseDate
+from django.conf import settings
 from django.utils import timezone
 from harvest_api_client import Harvest as HarvestSuper
 from harvest_api_client.harvest import (
@@ -65,7 +67,7 @@ class TokensManager(TokensManagerSuper):
             client_secret=self.client_secret
         )
         headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'}
-        resp = requests.post('https://api.harvestapp.com/v2/oauth2/token', headers=headers, data=body, verify=False)
+        resp = transport.post('https://api.harvestapp.com/v2/oauth2/token', headers=headers, data=body, verify=False)
         if resp.status_code >= 400:
             return None
         return json.loads(resp.content.decode())
@@ -130,17 +132,29 @@ class Harvest(HarvestSuper):
 
         setattr(self, klass.plural_name, _get_items)
 
-    def _get_element_values(self, url, tagname=None, query_params={}):
-        response = self._request(url, query_params)
-        if tagname:
-            elements = response.get(tagname, {})
-            for element in elements:
+    def _get_element_values(self, url, tagname=None, query_params=None):
+        '''
+        Yields the elements of a list endpoint one page at a time,
+        following the next page links, or the single response of any
+        other endpoint.
+        '''
+        query_params = dict(query_params or {})
+        if not tagname:
+            yield self._request(url, query_params)
+            return
+
+        query_params.setdefault('per_page', settings.HARVEST_PER_PAGE)
+        while url:
+            response = self._request(url, query_params)
+            for element in response.get(tagname, []):
                 yield dict(element)
-        else:
-            yield response
+            # The next link already has the query parameters in it
+            url = (response.get('links') or {}).get('next')
+            query_params = {}
 
-    def _request(self, url, query_params={}):
-        full_url = self.uri + url
+    def _request(self, url, query_params=None):
+        query_params = query_params if query_params is not None else {}
+        full_url = url if url.startswith('https://') else self.uri + url
 
         query_params['access_token'] = self.access_token
         if self.account_id:
@@ -159,16 +173,17 @@ class Harvest(HarvestSuper):
             else:
                 raise HarvestError('You must re-authenticate')
 
-            return requests.get(full_url,
-                                headers=self.headers,
-                                params=query_params).json()
+            return transport.get(full_url,
+                                 headers=self.headers,
+                                 params=query_params).json()
         except (requests.ConnectionError,
                 requests.Timeout,
                 requests.TooManyRedirects) as e:
             raise HarvestConnectionError(e)
 
-    def _time_entries(self, start=None, end=None, query_params={}):
+    def _time_entries(self, start=None, end=None, query_params=None):
         url = '/time_entries'
+        query_params = dict(query_params or {})
 
         if start:
             query_params['from'] = start.isoformat()
@@ -214,6 +229,12 @@ class Entry(HarvestItemBase):
     def task(self):
         return self.harvest.task(self._task['id'])
 
+    @property
+    def task_name(self):
+        # Entries embed their task's id and name, which is all
+        # an import needs, so this doesn't fetch the task
+        return self._task.get('name')
+
 
 class UserAssignment(HarvestItemBase):
     def __str__(self):
@@ -1,5 +1,10 @@
+import importlib
+
 from django.apps import AppConfig
 
 
 class ProjectsConfig(AppConfig):
     name = 'projects'
+
+    def ready(self):
+        importlib.import_module("projects.receivers")
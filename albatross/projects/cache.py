@@ -0,0 +1,69 @@
+import hashlib
+import logging
+import threading
+import uuid
+
+from django.core.cache import cache
+
+PROJECT_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+# How many lookups go by between the hit rate being logged
+PROJECT_LIST_STATS_LOG_EVERY = 1000
+
+logger = logging.getLogger(__name__)
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def get_project_list_version_key(team_id):
+    return 'team_{}:projects:version'.format(team_id)
+
+
+def get_project_list_key(team_id, full_path):
+    # Every team has a version that changes whenever one of its projects,
+    # categories or items does, so bumping it invalidates every variant
+    # (fields, include, page) of the team's cached project list at once.
+    version_key = get_project_list_version_key(team_id)
+    version = cache.get(version_key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(version_key, version, None)
+    return 'team_{}:projects:{}:{}'.format(team_id, version,
+                                           hashlib.md5(full_path.encode('utf-8')).hexdigest())
+
+
+def invalidate_project_list(team_id):
+    cache.delete(get_project_list_version_key(team_id))
+
+
+def record(hit):
+    # Hits and misses are counted per process rather than in the cache,
+    # which would cost every request a write to a shared row
+    with _stats_lock:
+        _stats['hits' if hit else 'misses'] += 1
+        stats = dict(_stats)
+    total = stats['hits'] + stats['misses']
+    if total % PROJECT_LIST_STATS_LOG_EVERY == 0:
+        logger.info('Project list cache: %d hits, %d misses (%.1f%% hit rate)',
+                    stats['hits'], stats['misses'], stats['hits'] / total * 100)
+
+
+def get_project_list(team_id, full_path):
+    cache_key = get_project_list_key(team_id, full_path)
+    content = cache.get(cache_key)
+    record(content is not None)
+    return cache_key, content
+
+
+def set_project_list(cache_key, content):
+    cache.set(cache_key, content, PROJECT_LIST_CACHE_TIMEOUT)
+
+
+def get_project_list_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_project_list_stats():
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
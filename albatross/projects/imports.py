@@ -0,0 +1,120 @@
+"""
+Helpers shared by the Toggl and Harvest import hooksets.
+
+Imported entries are kept in the TimeEntry ledger and items' actual hours
+are added up from it. Imports are incremental: entries dated more than
+IMPORT_SETTLE_DAYS days before the previous import are assumed not to
+change, so a routine import only fetches and replaces the entries from
+then on. A full rescan (reconcile) replaces the whole ledger.
+"""
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from .cache import invalidate_project_list
+from .models import Item, Project, TimeEntry, bulk_update
+from .signals import project_imported
+
+
+def make_item_key(item):
+    return "{}:{}".format(item.category.name.lower(),
+                          item.description.lower())
+
+
+def get_import_window(project, reconcile=False):
+    """
+    Returns the day to fetch entries from, or None when the provider's
+    whole history has to be fetched again.
+    """
+    # Projects imported before entries were stored have none to add up
+    if reconcile or project.last_imported_date is None or not project.time_entries.exists():
+        return None
+    return project.last_imported_date.date() - timedelta(days=settings.IMPORT_SETTLE_DAYS)
+
+
+@transaction.atomic
+def save_time_entries(project, provider, time_entries, since=None):
+    """
+    Replaces the project's ledger entries from `since` on (all of them
+    when it's None) with the given, freshly fetched, ones. Entries that
+    were deleted from the provider within the window go away with it,
+    and entries moved into it from an earlier day replace the stored copy.
+    """
+    # Report pages can shift while they're paged through, so an entry
+    # may have been fetched twice. The last copy wins.
+    time_entries = list(OrderedDict((time_entry.provider_entry_id, time_entry)
+                                    for time_entry in time_entries).values())
+
+    stored_entries = TimeEntry.objects.filter(project=project, provider=provider)
+    if since is not None:
+        entry_ids = [time_entry.provider_entry_id for time_entry in time_entries]
+        stored_entries = stored_entries.filter(Q(spent_on__gte=since) | Q(provider_entry_id__in=entry_ids))
+    stored_entries.delete()
+
+    for time_entry in time_entries:
+        time_entry.project = project
+        time_entry.provider = provider
+    TimeEntry.objects.bulk_create(time_entries)
+
+
+def get_ledger_totals(project, provider):
+    totals = TimeEntry.objects.filter(project=project, provider=provider) \
+        .annotate(category_key=Lower('category_name'), description_key=Lower('description')) \
+        .order_by().values('category_key', 'description_key') \
+        .annotate(total=Sum('hours'))
+    return {"{}:{}".format(total['category_key'], total['description_key']): total['total']
+            for total in totals}
+
+
+@transaction.atomic
+def update_actuals(project, provider):
+    """
+    Sets the actual hours of the project's items to the hours of the
+    ledger entries with the same category name and description. Only the
+    items whose hours changed are written, with a single UPDATE, and the
+    number of them is returned.
+    """
+    totals = get_ledger_totals(project, provider)
+    now = timezone.now()
+    changed_items = []
+    items = Item.objects.filter(category__project=project).select_related('category').select_for_update()
+    for item in items:
+        actual = totals.get(make_item_key(item), Decimal(0)).quantize(Decimal('0.01'))
+        if item.actual != actual:
+            item.actual = actual
+            item.updated_at = now
+            changed_items.append(item)
+
+    if changed_items:
+        # bulk_update skips the rollup and cache receivers
+        bulk_update(changed_items, ['actual', 'updated_at'])
+        project.refresh_rollups()
+        invalidate_project_list(project.team_id)
+    return len(changed_items)
+
+
+def finish_import(project, provider, time_entries, since=None):
+    """
+    Stores the entries fetched for a project, updates its items from
+    them and marks it as imported. Returns the number of items changed.
+
+    This is the commit phase of an import: everything is fetched from
+    the provider beforehand, outside of any transaction, so the rows
+    locked here are only held for as long as the writes take.
+    """
+    with transaction.atomic():
+        # Concurrent imports of the same project commit one at a time
+        Project.objects.select_for_update().filter(pk=project.pk).exists()
+        save_time_entries(project, provider, time_entries, since)
+        changed = update_actuals(project, provider)
+        project.last_imported_date = timezone.now()
+        # The project may have been edited since it was loaded
+        project.save(update_fields=['last_imported_date', 'updated_at'])
+    project_imported.send(sender=project.__class__, project=project)
+    return changed
@@ -0,0 +1,255 @@
+"""
+Background imports. ProjectUpdateActualTimeView and the nightly import
+only queue ImportJobs; any number of run_import_jobs workers, on any
+node, claim queued jobs and run them.
+
+A worker claims a job with SELECT ... FOR UPDATE SKIP LOCKED, so workers
+never wait on each other, and holds it for IMPORT_JOB_LEASE_SECONDS. A
+heartbeat keeps extending the lease while the import runs; when a worker
+dies its job's lease runs out and another worker claims it. The attempt
+number works as a fencing token: a worker whose lease was taken over can
+no longer extend it or record the job's outcome. Failed jobs are tried
+again after a delay that doubles with every attempt.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from harvest.hooks import hookset as harvest_hookset
+from toggl.hooks import hookset as toggl_hookset
+
+from .models import ImportJob, Project, ProviderProjectLink
+
+PROVIDER_HOOKSETS = {
+    ProviderProjectLink.HARVEST: harvest_hookset,
+    ProviderProjectLink.TOGGL: toggl_hookset
+}
+
+
+def get_provider_credentials(user_profile, provider):
+    if provider == ProviderProjectLink.HARVEST and user_profile.harvest_access_token:
+        return {
+            'access_token': user_profile.harvest_access_token,
+            'refresh_token': user_profile.harvest_refresh_token,
+            'tokens_last_refreshed_at': user_profile.harvest_tokens_last_refreshed_at
+        }
+    if provider == ProviderProjectLink.TOGGL and user_profile.toggl_api_key:
+        return user_profile.toggl_api_key
+    return None
+
+
+def get_api_key(user_profile):
+    for provider in (ProviderProjectLink.HARVEST, ProviderProjectLink.TOGGL):
+        api_key = get_provider_credentials(user_profile, provider)
+        if api_key:
+            return api_key, PROVIDER_HOOKSETS[provider]
+    return None, None
+
+
+def get_import_credentials(user, project):
+    """
+    Returns the credentials and hookset to import the project with: the
+    user's own, or else those of the team's creator. Raises
+    ObjectDoesNotExist when neither has connected Toggl or Harvest.
+    """
+    if user is not None:
+        user_profile = getattr(user, 'profile', None)
+        if user_profile:
+            api_key, hookset = get_api_key(user_profile)
+            if api_key:
+                return api_key, hookset
+    api_key, hookset = get_api_key(project.team.creator.profile)
+    if not api_key:
+        raise ObjectDoesNotExist()
+    return api_key, hookset
+
+
+def get_job_credentials(job):
+    if job.team_id is None:
+        return get_import_credentials(job.requested_by, job.project)
+    user_profile = getattr(job.requested_by, 'profile', None)
+    api_credentials = user_profile and get_provider_credentials(user_profile, job.provider)
+    if not api_credentials:
+        raise ObjectDoesNotExist()
+    return api_credentials, PROVIDER_HOOKSETS[job.provider]
+
+
+@transaction.atomic
+def enqueue_import(project, user):
+    """
+    Queues an import of the project, unless one is already queued or
+    running, in which case that job is returned instead.
+    """
+    # Lock the project so concurrent requests can't both queue a job
+    Project.objects.select_for_update().filter(pk=project.pk).exists()
+    job = project.import_jobs.filter(status__in=ImportJob.ACTIVE_STATUSES).first()
+    if job is None:
+        job = ImportJob.objects.create(project=project, requested_by=user)
+    return job
+
+
+def enqueue_team_import(team_id, provider, user, reconcile=False):
+    """
+    Queues an import of all of a team's projects from the provider, with
+    the user's credentials, unless one is already queued or running.
+    Returns the job and whether it was created, like get_or_create.
+    """
+    job = ImportJob.objects.filter(team_id=team_id, provider=provider,
+                                   status__in=ImportJob.ACTIVE_STATUSES).first()
+    if job is not None:
+        return job, False
+    return ImportJob.objects.create(team_id=team_id, provider=provider, reconcile=reconcile,
+                                    requested_by=user), True
+
+
+def get_busy_providers(now):
+    # Team imports are capped per provider to stay within their rate
+    # limits. The count isn't locked, so workers claiming at the same
+    # moment may briefly go over.
+    limits = {
+        ProviderProjectLink.HARVEST: settings.HARVEST_IMPORT_CONCURRENCY,
+        ProviderProjectLink.TOGGL: settings.TOGGL_IMPORT_CONCURRENCY
+    }
+    running = ImportJob.objects.filter(status=ImportJob.RUNNING, lease_expires_at__gt=now,
+                                       team__isnull=False) \
+        .order_by().values('provider').annotate(count=Count('pk'))
+    return [row['provider'] for row in running if row['count'] >= limits.get(row['provider'], 0)]
+
+
+def claim_import_job():
+    """
+    Claims the oldest job that's queued, or whose lease ran out, and
+    returns it, or returns None when there's nothing to do.
+    """
+    now = timezone.now()
+    # Jobs whose lease ran out on their last attempt are given up on
+    ImportJob.objects.filter(status=ImportJob.RUNNING, lease_expires_at__lte=now,
+                             attempts__gte=settings.IMPORT_JOB_MAX_ATTEMPTS) \
+        .update(status=ImportJob.FAILED, error='The import timed out.', finished_at=now, updated_at=now)
+
+    jobs = ImportJob.objects.filter(Q(status=ImportJob.QUEUED) |
+                                    Q(status=ImportJob.RUNNING, lease_expires_at__lte=now)) \
+        .filter(Q(not_before__isnull=True) | Q(not_before__lte=now))
+    busy_providers = get_busy_providers(now)
+    if busy_providers:
+        jobs = jobs.exclude(team__isnull=False, provider__in=busy_providers)
+
+    with transaction.atomic():
+        # Jobs being claimed by other workers are skipped, not waited on
+        job = jobs.select_for_update(skip_locked=True).order_by('created_at').first()
+        if job is None:
+            return None
+        job.attempts += 1
+        job.lease_expires_at = now + timedelta(seconds=settings.IMPORT_JOB_LEASE_SECONDS)
+        job.started_at = now
+        job.status = ImportJob.RUNNING
+        job.save()
+    return job
+
+
+def finish_import_job(job, **fields):
+    """
+    Records the outcome of the job's current attempt, unless its lease
+    has been taken over by another worker since. Returns whether it was.
+    """
+    fields['updated_at'] = timezone.now()
+    for field_name, value in fields.items():
+        setattr(job, field_name, value)
+    return bool(ImportJob.objects.filter(pk=job.pk, attempts=job.attempts).update(**fields))
+
+
+def extend_lease(job):
+    """
+    Extends the lease of the job's current attempt, unless it's been
+    taken over by another worker since. Returns whether it was.
+    """
+    now = timezone.now()
+    return bool(ImportJob.objects.filter(pk=job.pk, attempts=job.attempts, status=ImportJob.RUNNING)
+                .update(lease_expires_at=now + timedelta(seconds=settings.IMPORT_JOB_LEASE_SECONDS),
+                        updated_at=now))
+
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    Extends a job's lease every IMPORT_JOB_HEARTBEAT_SECONDS while its
+    import runs, so imports that take longer than a lease aren't claimed
+    by another worker. It stops by itself once the job is taken over.
+    """
+
+    def __init__(self, job):
+        super().__init__(daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.IMPORT_JOB_HEARTBEAT_SECONDS):
+                if not extend_lease(self.job):
+                    return
+        finally:
+            # The thread has a database connection of its own
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_import_job(job):
+    try:
+        api_key, hookset = get_job_credentials(job)
+    except ObjectDoesNotExist:
+        finish_import_job(job, error='Please login with Harvest or provide a Toggl API key.',
+                          finished_at=timezone.now(), lease_expires_at=None, status=ImportJob.FAILED)
+        return job
+
+    heartbeat = LeaseHeartbeat(job)
+    heartbeat.start()
+    try:
+        if job.team_id is None:
+            changed = job.project.update_actual(api_key, hookset, reconcile=job.reconcile)
+        else:
+            projects = Project.objects.filter(team_id=job.team_id, archived=False)
+            changed = hookset.update_team_line_item_times(self=hookset,
+                                                          api_credentials=api_key,
+                                                          projects=projects,
+                                                          reconcile=job.reconcile)
+    except Exception as e:
+        # A failed import mustn't take the worker down with it. It's
+        # tried again, after a while, until it runs out of attempts.
+        heartbeat.stop()
+        error = str(e) or e.__class__.__name__
+        if job.attempts < settings.IMPORT_JOB_MAX_ATTEMPTS:
+            retry_delay = settings.IMPORT_JOB_RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1)
+            finish_import_job(job, error=error, lease_expires_at=None,
+                              not_before=timezone.now() + timedelta(seconds=retry_delay),
+                              status=ImportJob.QUEUED)
+        else:
+            finish_import_job(job, error=error, finished_at=timezone.now(), lease_expires_at=None,
+                              status=ImportJob.FAILED)
+        return job
+
+    heartbeat.stop()
+    finish_import_job(job, changed_items=changed, error='', finished_at=timezone.now(),
+                      lease_expires_at=None, status=ImportJob.SUCCEEDED)
+    return job
+
+
+def run_import_jobs(poll_seconds=None):
+    """
+    Runs queued jobs until there are none left, or forever, checking for
+    new ones every poll_seconds, when that's given.
+    """
+    while True:
+        job = claim_import_job()
+        if job is not None:
+            run_import_job(job)
+        elif poll_seconds is None:
+            return
+        else:
+            time.sleep(poll_seconds)
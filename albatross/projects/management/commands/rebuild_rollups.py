@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from projects.models import rebuild_rollups, rollup_drift
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the stored actual/estimated totals of every project and category from their items.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', dest='check',
+                            help='Only report totals that are out of date, without rebuilding them.')
+
+    def report_drift(self):
+        categories, projects = rollup_drift()
+        for category in categories:
+            self.stdout.write('Category {} stores {}/{} but its items add up to {}/{}'.format(
+                category.pk, category.total_actual, category.total_estimated,
+                category.items_actual, category.items_estimated))
+        for project in projects:
+            self.stdout.write('Project {} stores {}/{} but its items add up to {}/{}'.format(
+                project.pk, project.total_actual, project.total_estimated,
+                project.items_actual, project.items_estimated))
+        return len(categories) + len(projects)
+
+    def handle(self, *args, **options):
+        if options['check']:
+            if self.report_drift():
+                raise CommandError('Some stored totals are out of date.')
+            self.stdout.write('All stored totals are up to date.')
+            return
+
+        with transaction.atomic():
+            rebuild_rollups()
+            if self.report_drift():
+                raise CommandError('Stored totals still differ after rebuilding.')
+        self.stdout.write('Rebuilt all stored totals.')
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from projects.jobs import run_import_jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued Toggl and Harvest imports, waiting for new ones unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', dest='once',
+                            help='Exit once there are no queued imports left.')
+
+    def handle(self, *args, **options):
+        run_import_jobs(None if options['once'] else settings.IMPORT_JOB_POLL_SECONDS)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 06:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+
+def init_rollups(apps, schema_editor):
+    Category = apps.get_model("projects", "Category")
+    Project = apps.get_model("projects", "Project")
+
+    for category in Category.objects.annotate(actual=Coalesce(Sum('items__actual'), 0),
+                                              estimated=Coalesce(Sum('items__estimated'), 0)):
+        Category.objects.filter(pk=category.pk).update(total_actual=category.actual,
+                                                       total_estimated=category.estimated)
+
+    for project in Project.objects.annotate(actual=Coalesce(Sum('categories__total_actual'), 0),
+                                            estimated=Coalesce(Sum('categories__total_estimated'), 0)):
+        Project.objects.filter(pk=project.pk).update(total_actual=project.actual,
+                                                     total_estimated=project.estimated)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0014_auto_20171103_2012'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='total_actual',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='total_estimated',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='total_actual',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='total_estimated',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(init_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 06:56
+from __future__ import unicode_literals
+
+from datetime import date, datetime, timedelta
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def parse_week_label(label, before):
+    # Labels were stored as '%b %d' without a year, newest first, so pick
+    # the latest date with that month and day that isn't after the
+    # previously parsed one.
+    parsed = datetime.strptime('2000 ' + label, '%Y %b %d')
+    for year in (before.year, before.year - 1):
+        try:
+            candidate = date(year, parsed.month, parsed.day)
+        except ValueError:
+            candidate = date(year, parsed.month, parsed.day - 1)
+        if candidate <= before:
+            return candidate
+    return candidate
+
+
+def copy_previous_weeks_hours(apps, schema_editor):
+    Project = apps.get_model("projects", "Project")
+    WeeklyHours = apps.get_model("projects", "WeeklyHours")
+
+    for project in Project.objects.all():
+        weeks = {}
+        reported_on = date.today()
+        for hours, label in project.previous_weeks_hours or []:
+            reported_on = parse_week_label(label, reported_on)
+            # Weeks start on the Monday before the report's
+            week_start = reported_on - timedelta(days=7 + reported_on.weekday())
+            weeks[week_start] = weeks.get(week_start, 0) + hours
+
+        WeeklyHours.objects.bulk_create([
+            WeeklyHours(project=project, week_start=week_start, hours=hours)
+            for week_start, hours in weeks.items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0015_project_category_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyHours',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('hours', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('week_start', models.DateField()),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_hours', to='projects.Project')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='weeklyhours',
+            unique_together=set([('project', 'week_start')]),
+        ),
+        migrations.RunPython(copy_previous_weeks_hours, migrations.RunPython.noop),
+    ]
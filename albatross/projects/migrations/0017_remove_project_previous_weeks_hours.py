@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 06:56
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0016_weeklyhours'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='project',
+            name='previous_weeks_hours',
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 06:58
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0017_remove_project_previous_weeks_hours'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='category',
+            index_together=set([('updated_at', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='item',
+            index_together=set([('updated_at', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='project',
+            index_together=set([('updated_at', 'id')]),
+        ),
+    ]
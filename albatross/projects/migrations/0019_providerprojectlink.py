@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 07:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0018_updated_at_id_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderProjectLink',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('provider', models.CharField(choices=[('harvest', 'Harvest'), ('toggl', 'Toggl')], max_length=20)),
+                ('provider_project_id', models.BigIntegerField()),
+                ('workspace_id', models.BigIntegerField(blank=True, null=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='provider_links', to='projects.Project')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='providerprojectlink',
+            unique_together=set([('project', 'provider')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 07:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0019_providerprojectlink'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category_name', models.CharField(blank=True, max_length=200)),
+                ('description', models.CharField(blank=True, max_length=3000)),
+                ('hours', models.DecimalField(decimal_places=6, max_digits=12)),
+                ('provider', models.CharField(choices=[('harvest', 'Harvest'), ('toggl', 'Toggl')], max_length=20)),
+                ('provider_entry_id', models.BigIntegerField()),
+                ('spent_on', models.DateField()),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='time_entries', to='projects.Project')),
+            ],
+            options={
+                'verbose_name_plural': 'time entries',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='timeentry',
+            unique_together=set([('project', 'provider', 'provider_entry_id')]),
+        ),
+    ]
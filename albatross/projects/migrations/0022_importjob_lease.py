@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 07:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('teams', '0006_auto_20170928_1922'),
+        ('projects', '0021_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='provider',
+            field=models.CharField(blank=True, choices=[('harvest', 'Harvest'), ('toggl', 'Toggl')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='reconcile',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='team',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='teams.Team'),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='project',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='projects.Project'),
+        ),
+        migrations.AlterIndexTogether(
+            name='importjob',
+            index_together=set([('status', 'created_at'), ('updated_at', 'id')]),
+        ),
+    ]
@@ -1,13 +1,18 @@
 import decimal
+from datetime import timedelta
 
+from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import Sum
-from django.db.models.functions import Coalesce
-from django.contrib.postgres.fields import ArrayField
-from picklefield.fields import PickledObjectField
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
 from teams.models import Team
 
+from .signals import item_deleted
+
+
+ROLLUP_FIELDS = ('total_actual', 'total_estimated')
+
 
 class CommonInfo(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
@@ -15,65 +20,438 @@ class CommonInfo(models.Model):
 
     class Meta:
         abstract = True
+        # Backs the keyset pagination in projects.pagination
+        index_together = [('updated_at', 'id')]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember what was loaded so receivers can tell what changed.
+        instance = super(CommonInfo, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super(CommonInfo, self).refresh_from_db(using=using, fields=fields)
+        # The values just loaded are the ones receivers compare against now
+        loaded_values = getattr(self, '_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (fields is None or field.name in fields or
+                                                   field.attname in fields):
+                loaded_values[field.attname] = getattr(self, field.attname)
+        self._loaded_values = loaded_values
+
+
+class RollupInfo(models.Model):
+    """
+    Stores the sum of actual and estimated hours of the items below
+    a model so reading them doesn't need an aggregate query. The totals
+    are kept up to date by projects.receivers and can be rebuilt with
+    the rebuild_rollups management command.
+    """
+    total_actual = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    total_estimated = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # The totals are only written with queryset updates, so never
+        # let a stale instance overwrite them on a regular save.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ROLLUP_FIELDS
+            ]
+        super(RollupInfo, self).save(*args, **kwargs)
+
+
+ITEM_UNDER = 'under'
+ITEM_CLOSE = 'close'
+ITEM_OVER = 'over'
+
+# Items within this fraction of their estimate are close to going over
+ITEM_CLOSE_MARGIN = decimal.Decimal('0.1')
+
+
+def item_status_conditions(prefix=''):
+    """
+    Returns the conditions for an item, at the given lookup path (e.g.
+    'categories__items__'), being over and being close to its estimate.
+    They match the thresholds of the weekly report's get_status.
+    """
+    actual, estimated = prefix + 'actual', prefix + 'estimated'
+    over = Q(**{actual + '__gt': F(estimated)})
+    close = Q(**{estimated + '__gt': 0,
+                 actual + '__lte': F(estimated),
+                 actual + '__gte': F(estimated) * (1 - ITEM_CLOSE_MARGIN)})
+    return over, close
+
+
+class ProjectQuerySet(models.QuerySet):
+    def with_category_ids(self):
+        """
+        Prefetches just the ids of each project's categories, which is all
+        the categories relationship needs to render.
+        """
+        categories = Category.objects.only('id', 'project_id')
+        return self.prefetch_related(Prefetch('categories', queryset=categories))
 
+    def with_tree(self):
+        """
+        Prefetches each project's categories and their items.
+        """
+        categories = Category.objects.prefetch_related('items')
+        return self.prefetch_related(Prefetch('categories', queryset=categories))
 
-class Project(CommonInfo):
+    def with_tree_version(self):
+        """
+        Annotates what changes whenever anything in a project's estimate
+        sheet does: the latest updated_at of its categories and items, and
+        how many of them there are so deletions are noticed too.
+        """
+        return self.annotate(
+            categories_count=Count('categories', distinct=True),
+            categories_updated_at=Max('categories__updated_at'),
+            items_count=Count('categories__items'),
+            items_updated_at=Max('categories__items__updated_at')
+        )
+
+    def with_item_status_counts(self):
+        """
+        Annotates how many of each project's items are under, close to and
+        over their estimate (items_under, items_close and items_over),
+        classified in the database by a single aggregate query.
+        """
+        over, close = item_status_conditions('categories__items__')
+        items_over = Count(Case(When(over, then=1)))
+        items_close = Count(Case(When(close, then=1)))
+        return self.annotate(
+            items_close=items_close,
+            items_over=items_over,
+            items_under=Count('categories__items') - items_close - items_over
+        )
+
+    def with_item_totals(self):
+        """
+        Annotates the sum of each project's items computed from scratch,
+        as opposed to the stored total_actual/total_estimated.
+        """
+        return self.annotate(
+            items_actual=Coalesce(Sum('categories__items__actual'), 0),
+            items_estimated=Coalesce(Sum('categories__items__estimated'), 0)
+        )
+
+
+class Project(CommonInfo, RollupInfo):
     archived = models.BooleanField(default=False)
     buffer = models.IntegerField(default=0, validators=[MinValueValidator(0), MaxValueValidator(100)])
     last_weeks_hours = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     last_imported_date = models.DateTimeField(null=True, blank=True)
     name = models.CharField(max_length=200)
-    previous_weeks_hours = ArrayField(PickledObjectField(), blank=True, default=list)
     team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='projects')
 
+    objects = ProjectQuerySet.as_manager()
+
     @property
     def actual(self):
-        aggregate_results = self.categories.aggregate(sum=Coalesce(Sum('items__actual'), 0))
-        return aggregate_results['sum']
+        return self.total_actual
 
     @property
     def estimated(self):
-        aggregate_results = self.categories.aggregate(
-            sum=Coalesce(Sum('items__estimated'), 0))
-        sum = aggregate_results['sum']
+        # The buffer is applied on read so changing it never
+        # requires the stored totals to be rewritten.
         buffer_percentage = decimal.Decimal(1 + (self.buffer / 100))
-        estimated = sum * buffer_percentage
+        estimated = self.total_estimated * buffer_percentage
         return round(estimated, 2)
 
-    def update_actual(self, api_key, hookset):
-        hookset.update_project_line_item_times(
+    def refresh_rollups(self):
+        rebuild_rollups(Project.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=ROLLUP_FIELDS)
+
+    @transaction.atomic
+    def clone(self, name, reset_actual=False):
+        """
+        Copies the project with all of its categories and items. Rows are
+        written with bulk_create, which skips the rollup receivers, so the
+        totals of the copies are filled in here.
+        """
+        categories = list(self.categories.prefetch_related('items'))
+        totals = {}
+        for category in categories:
+            items = category.items.all()
+            actual = 0 if reset_actual else sum(item.actual for item in items)
+            totals[category.pk] = (actual, sum(item.estimated for item in items))
+
+        project = Project.objects.create(
+            buffer=self.buffer,
+            name=name,
+            team_id=self.team_id,
+            total_actual=sum(actual for actual, _ in totals.values()),
+            total_estimated=sum(estimated for _, estimated in totals.values())
+        )
+        category_copies = Category.objects.bulk_create([
+            Category(name=category.name,
+                     project=project,
+                     total_actual=totals[category.pk][0],
+                     total_estimated=totals[category.pk][1])
+            for category in categories
+        ])
+        Item.objects.bulk_create([
+            Item(actual=0 if reset_actual else item.actual,
+                 category=category_copy,
+                 description=item.description,
+                 estimated=item.estimated)
+            for category, category_copy in zip(categories, category_copies)
+            for item in category.items.all()
+        ])
+        return project
+
+    def update_actual(self, api_key, hookset, reconcile=False):
+        return hookset.update_project_line_item_times(
             self=hookset,
             api_credentials=api_key,
-            project_to_update=self
+            project_to_update=self,
+            reconcile=reconcile
         )
 
     class JSONAPIMeta:
         resource_name = "projects"
 
 
-class Category(CommonInfo):
+class Category(CommonInfo, RollupInfo):
     name = models.CharField(max_length=200)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='categories')
 
     @property
     def actual(self):
-        aggregate_results = self.items.aggregate(sum=Coalesce(Sum('actual'), 0))
-        return aggregate_results['sum']
+        return self.total_actual
 
     @property
     def estimated(self):
-        aggregate_results = self.items.aggregate(sum=Coalesce(Sum('estimated'), 0))
-        return aggregate_results['sum']
+        return self.total_estimated
 
     class JSONAPIMeta:
         resource_name = "categories"
 
 
+class ItemQuerySet(models.QuerySet):
+    def with_status(self):
+        """
+        Annotates each item's status: under, close to or over its estimate.
+        """
+        over, close = item_status_conditions()
+        return self.annotate(status=Case(
+            When(over, then=Value(ITEM_OVER)),
+            When(close, then=Value(ITEM_CLOSE)),
+            default=Value(ITEM_UNDER),
+            output_field=models.CharField()
+        ))
+
+
 class Item(CommonInfo):
     actual = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='items')
     description = models.CharField(max_length=200)
     estimated = models.DecimalField(max_digits=10, decimal_places=2)
 
+    objects = ItemQuerySet.as_manager()
+
     class JSONAPIMeta:
         resource_name = "items"
+
+    def save(self, *args, **kwargs):
+        # The stored row is locked by the pre_save receiver until the
+        # totals are updated from it in post_save (see projects.receivers)
+        with transaction.atomic():
+            super(Item, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super(Item, self).delete(*args, **kwargs)
+            item_deleted.send(sender=self.__class__, item=self)
+        return result
+
+
+class WeeklyHours(CommonInfo):
+    """
+    Hours tracked on a project during the week (Monday to Sunday) starting
+    at week_start, as recorded by the weekly progress report.
+    """
+    hours = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='weekly_hours')
+    week_start = models.DateField()
+
+    class Meta:
+        unique_together = [('project', 'week_start')]
+
+    @staticmethod
+    def week_containing(day):
+        # Weeks start on Monday
+        return day - timedelta(days=day.weekday())
+
+    @staticmethod
+    def label_for(week_start):
+        # Weeks are labelled with the start of the week they were reported in
+        return (week_start + timedelta(days=7)).strftime('%b %d')
+
+    @property
+    def label(self):
+        return self.label_for(self.week_start)
+
+
+class ProviderProjectLink(CommonInfo):
+    """
+    The Toggl or Harvest project a project imports its hours from. It's
+    found by name on the first import and reused by later ones, which
+    only look for the project again if the link stops matching.
+    """
+    HARVEST = 'harvest'
+    TOGGL = 'toggl'
+    PROVIDER_CHOICES = (
+        (HARVEST, 'Harvest'),
+        (TOGGL, 'Toggl'),
+    )
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='provider_links')
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
+    provider_project_id = models.BigIntegerField()
+    workspace_id = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [('project', 'provider')]
+
+    @classmethod
+    def link(cls, project, provider, provider_project_id, workspace_id=None):
+        return cls.objects.update_or_create(project=project, provider=provider, defaults={
+            'provider_project_id': provider_project_id,
+            'workspace_id': workspace_id
+        })[0]
+
+
+class TimeEntry(CommonInfo):
+    """
+    A time entry imported from Toggl or Harvest. Items' actual hours are
+    added up from these (see projects.imports), so matching them against
+    renamed categories or items doesn't need the provider.
+    """
+    category_name = models.CharField(max_length=200, blank=True)
+    description = models.CharField(max_length=3000, blank=True)
+    hours = models.DecimalField(max_digits=12, decimal_places=6)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='time_entries')
+    provider = models.CharField(max_length=20, choices=ProviderProjectLink.PROVIDER_CHOICES)
+    provider_entry_id = models.BigIntegerField()
+    spent_on = models.DateField()
+
+    class Meta:
+        unique_together = [('project', 'provider', 'provider_entry_id')]
+        verbose_name_plural = 'time entries'
+
+
+class ImportJob(CommonInfo):
+    """
+    A unit of import work, queued for the run_import_jobs workers: either
+    one project, when import is clicked in the app, or all of a team's
+    projects from one provider, for the nightly import. Clicking import
+    again while a project's job is queued or running reuses that job.
+
+    Workers on any node claim jobs with a lease, which they keep
+    extending while the import runs. A job whose lease runs out before it
+    finishes, because its worker died, is claimed again, up to
+    IMPORT_JOB_MAX_ATTEMPTS times, as are jobs that failed. Failed jobs
+    aren't claimed again before not_before.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+    ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+    attempts = models.PositiveIntegerField(default=0)
+    changed_items = models.IntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    not_before = models.DateTimeField(null=True, blank=True)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='import_jobs',
+                                null=True, blank=True)
+    provider = models.CharField(max_length=20, choices=ProviderProjectLink.PROVIDER_CHOICES, blank=True)
+    reconcile = models.BooleanField(default=False)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+                                     null=True, blank=True, related_name='import_jobs')
+    started_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='import_jobs',
+                             null=True, blank=True)
+
+    class Meta(CommonInfo.Meta):
+        # Backs the workers' search for the next job to claim
+        index_together = CommonInfo.Meta.index_together + [('status', 'created_at')]
+
+    class JSONAPIMeta:
+        resource_name = "import-jobs"
+
+
+def _category_totals(field):
+    items = Item.objects.filter(category=OuterRef('pk')).order_by().values('category')
+    return Coalesce(Subquery(items.annotate(total=Sum(field)).values('total'),
+                             output_field=models.DecimalField()), 0)
+
+
+def _project_totals(field):
+    categories = Category.objects.filter(project=OuterRef('pk')).order_by().values('project')
+    return Coalesce(Subquery(categories.annotate(total=Sum(field)).values('total'),
+                             output_field=models.DecimalField()), 0)
+
+
+def rebuild_rollups(projects=None):
+    """
+    Recomputes the stored totals of the given projects (all of them by
+    default) and their categories from their items.
+    """
+    if projects is None:
+        projects = Project.objects.all()
+    categories = Category.objects.filter(project__in=projects.values('pk'))
+    categories.update(total_actual=_category_totals('actual'),
+                      total_estimated=_category_totals('estimated'))
+    projects.update(total_actual=_project_totals('total_actual'),
+                    total_estimated=_project_totals('total_estimated'))
+
+
+def rollup_drift():
+    """
+    Returns the categories and projects whose stored totals don't
+    match the sum of their items.
+    """
+    categories = Category.objects.annotate(
+        items_actual=Coalesce(Sum('items__actual'), 0),
+        items_estimated=Coalesce(Sum('items__estimated'), 0)
+    ).filter(~Q(total_actual=F('items_actual')) | ~Q(total_estimated=F('items_estimated')))
+    projects = Project.objects.with_item_totals().filter(~Q(total_actual=F('items_actual')) | ~Q(total_estimated=F('items_estimated')))
+    return categories, projects
+
+
+def bulk_update(instances, field_names):
+    """
+    Writes the given fields of many instances of one model with a single
+    UPDATE, using a CASE expression per field. Values are cast to the
+    column type, as Postgres reads CASE parameters as text. Like
+    QuerySet.update it doesn't call save() or send any signals.
+    """
+    if not instances:
+        return 0
+    model = type(instances[0])
+    updates = {}
+    for field_name in field_names:
+        field = model._meta.get_field(field_name)
+        updates[field.attname] = Case(
+            *[When(pk=instance.pk, then=Cast(Value(getattr(instance, field.attname)), field))
+              for instance in instances],
+            output_field=field
+        )
+    return model.objects.filter(pk__in=[instance.pk for instance in instances]).update(**updates)
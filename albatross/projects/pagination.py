@@ -0,0 +1,97 @@
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    An opt-in, json-api compatible cursor pagination ordered on
+    (updated_at, id). Requests that don't ask for a page get the whole,
+    unpaginated list like before. For example:
+    http://api.example.org/items/?page[size]=100
+    http://api.example.org/items/?page[cursor]=MjAxNy0xMS0wM1QyMDoxMjowMCswMDowMHw0Mg&page[size]=100
+    """
+    cursor_query_param = 'page[cursor]'
+    invalid_cursor_message = 'Invalid cursor'
+    max_page_size = 100
+    ordering = ('updated_at', 'id')
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page[size]'
+
+    def decode_cursor(self, cursor):
+        try:
+            updated_at, id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii').split('|')
+            updated_at = parse_datetime(updated_at)
+            id = int(id)
+        except (binascii.Error, TypeError, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if updated_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return updated_at, id
+
+    def encode_cursor(self, instance):
+        position = '{}|{}'.format(instance.updated_at.isoformat(), instance.id)
+        return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii').rstrip('=')
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (self.cursor_query_param not in request.query_params
+                and self.page_size_query_param not in request.query_params):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            updated_at, id = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=id))
+
+        # Grab one extra row to find out if there is a next page
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_first_link(self):
+        url = self.request.build_absolute_uri()
+        return remove_query_param(url, self.cursor_query_param)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'results': data,
+            'meta': {
+                'pagination': OrderedDict([
+                    ('size', self.page_size),
+                ])
+            },
+            'links': OrderedDict([
+                ('first', self.get_first_link()),
+                ('next', self.get_next_link()),
+                ('prev', None)
+            ])
+        })
@@ -0,0 +1,46 @@
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+from rest_framework_json_api import exceptions, utils
+from rest_framework_json_api.parsers import JSONParser
+
+
+class BulkJSONParser(JSONParser):
+    """
+    Parses a json-api document whose primary data is a list of resource
+    objects, as sent to the bulk endpoints:
+
+        {
+            "data": [
+                {"type": "items", "id": "1", "attributes": {"actual": 3}},
+                {"type": "items", "id": "2", "attributes": {"actual": 5}}
+            ]
+        }
+
+    Returns a list with the attributes and relationships of each object.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        result = parsers.JSONParser.parse(self, stream, media_type=media_type, parser_context=parser_context)
+
+        if not isinstance(result, dict) or not isinstance(result.get('data'), list):
+            raise ParseError('Received document does not contain a list of resource objects')
+
+        resource_name = utils.get_resource_name(parser_context)
+        parsed_data = []
+        for data in result['data']:
+            if not isinstance(data, dict):
+                raise ParseError('Received data contains one or more malformed resource objects')
+            if data.get('type') != resource_name:
+                raise exceptions.Conflict(
+                    "The resource object's type ({data_type}) is not the type "
+                    "that constitute the collection represented by the endpoint ({resource_type}).".format(
+                        data_type=data.get('type'),
+                        resource_type=resource_name
+                    )
+                )
+
+            resource = {'id': data.get('id')} if 'id' in data else {}
+            resource.update(self.parse_attributes(data))
+            resource.update(self.parse_relationships(data))
+            parsed_data.append(resource)
+        return parsed_data
@@ -0,0 +1,162 @@
+from decimal import Decimal
+
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .cache import invalidate_project_list
+from .models import Category, Item, Project, rebuild_rollups
+from .signals import item_deleted, project_imported
+
+
+def to_hours(value):
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+ITEM_ROLLUP_ATTNAMES = ('category_id', 'actual', 'estimated')
+
+
+def loaded_value(instance, attname, default=None):
+    return getattr(instance, '_loaded_values', {}).get(attname, default)
+
+
+def apply_category_delta(category_id, actual, estimated, item=None):
+    if not actual and not estimated:
+        return
+    Category.objects.filter(pk=category_id).update(
+        total_actual=F('total_actual') + actual,
+        total_estimated=F('total_estimated') + estimated
+    )
+    Project.objects.filter(categories__pk=category_id).update(
+        total_actual=F('total_actual') + actual,
+        total_estimated=F('total_estimated') + estimated
+    )
+
+    # Keep instances the caller is holding on to in sync as well
+    if item is not None and Item.category.is_cached(item) and item.category_id == category_id:
+        category = item.category
+        category.total_actual += actual
+        category.total_estimated += estimated
+        if Category.project.is_cached(category):
+            category.project.total_actual += actual
+            category.project.total_estimated += estimated
+
+
+@receiver(pre_save, sender=Item)
+def handle_item_pre_save(sender, instance, **kwargs):
+    # The totals are moved by the difference with the stored row, not with
+    # what was loaded: the item may have been updated since, by a queryset
+    # update or another request. The row stays locked until post_save.
+    instance._stored_values = None
+    if instance.pk is not None:
+        instance._stored_values = Item.objects.select_for_update().filter(pk=instance.pk).values(
+            *ITEM_ROLLUP_ATTNAMES).first()
+
+
+@receiver(post_save, sender=Item)
+def handle_item_save(sender, instance, created, **kwargs):
+    actual = to_hours(instance.actual)
+    estimated = to_hours(instance.estimated)
+    stored_values = getattr(instance, '_stored_values', None)
+
+    if created or stored_values is None:
+        apply_category_delta(instance.category_id, actual, estimated, item=instance)
+    else:
+        old_category_id = stored_values['category_id']
+        old_actual = to_hours(stored_values['actual'])
+        old_estimated = to_hours(stored_values['estimated'])
+        if old_category_id == instance.category_id:
+            apply_category_delta(instance.category_id, actual - old_actual,
+                                 estimated - old_estimated, item=instance)
+        else:
+            apply_category_delta(old_category_id, -old_actual, -old_estimated)
+            apply_category_delta(instance.category_id, actual, estimated, item=instance)
+
+
+@receiver(item_deleted)
+def handle_item_delete(sender, item, **kwargs):
+    # Added up again, as the deleted instance's values may be stale
+    rebuild_rollups(Project.objects.filter(categories__pk=item.category_id))
+
+
+@receiver(pre_delete, sender=Category)
+def handle_category_delete(sender, instance, **kwargs):
+    # The category's totals are taken off its project, and the team's
+    # project list invalidated, once, rather than for each of its items
+    # as they're deleted along with it
+    stored = Category.objects.filter(pk=instance.pk) \
+        .values('total_actual', 'total_estimated', 'project__team_id').first()
+    if stored is None:
+        return
+    Project.objects.filter(pk=instance.project_id).update(
+        total_actual=F('total_actual') - stored['total_actual'],
+        total_estimated=F('total_estimated') - stored['total_estimated']
+    )
+    invalidate_project_list(stored['project__team_id'])
+
+
+@receiver(post_save, sender=Category)
+def handle_category_save(sender, instance, created, **kwargs):
+    old_project_id = loaded_value(instance, 'project_id')
+    if created or old_project_id is None or old_project_id == instance.project_id:
+        return
+
+    # The category moved to another project so its totals move with it
+    totals = Category.objects.filter(pk=instance.pk).values('total_actual', 'total_estimated').get()
+    Project.objects.filter(pk=old_project_id).update(
+        total_actual=F('total_actual') - totals['total_actual'],
+        total_estimated=F('total_estimated') - totals['total_estimated']
+    )
+    Project.objects.filter(pk=instance.project_id).update(
+        total_actual=F('total_actual') + totals['total_actual'],
+        total_estimated=F('total_estimated') + totals['total_estimated']
+    )
+    instance._loaded_values['project_id'] = instance.project_id
+
+
+def team_id_for_project(project_id, project=None):
+    if project is not None:
+        return project.team_id
+    return Project.objects.filter(pk=project_id).values_list('team_id', flat=True).first()
+
+
+def team_id_for_category(category_id, category=None):
+    if category is not None:
+        project = category.project if Category.project.is_cached(category) else None
+        return team_id_for_project(category.project_id, project)
+    return Project.objects.filter(categories__pk=category_id).values_list('team_id', flat=True).first()
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def handle_project_change(sender, instance, **kwargs):
+    invalidate_project_list(instance.team_id)
+
+
+@receiver(post_save, sender=Category)
+def handle_category_change(sender, instance, **kwargs):
+    team_id = team_id_for_category(instance.id, instance)
+    if team_id is not None:
+        invalidate_project_list(team_id)
+
+
+def invalidate_item_project_list(item):
+    category = item.category if Item.category.is_cached(item) else None
+    team_id = team_id_for_category(item.category_id, category)
+    if team_id is not None:
+        invalidate_project_list(team_id)
+
+
+@receiver(post_save, sender=Item)
+def handle_item_change(sender, instance, **kwargs):
+    invalidate_item_project_list(instance)
+
+
+@receiver(item_deleted)
+def handle_item_deleted(sender, item, **kwargs):
+    invalidate_item_project_list(item)
+
+
+@receiver(project_imported)
+def handle_project_imported(sender, project, **kwargs):
+    invalidate_project_list(project.team_id)
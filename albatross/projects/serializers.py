@@ -1,6 +1,6 @@
 from rest_framework_json_api import serializers
 from rest_framework_json_api.relations import ResourceRelatedField
-from .models import Category, Item, Project
+from .models import Category, ImportJob, Item, Project
 
 
 class ItemSerializer(serializers.ModelSerializer):
@@ -29,6 +29,9 @@ class CategorySerializer(serializers.ModelSerializer):
 
 
 class ProjectSerializer(serializers.ModelSerializer):
+    included_serializers = {
+        'categories': CategorySerializer
+    }
 
     categories = ResourceRelatedField(
             queryset=Category.objects,
@@ -41,3 +44,34 @@ class ProjectSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'estimated', 'categories', 'actual', 'created_at', 'updated_at', 'buffer',
                   'last_imported_date', 'archived')
 
+
+class ProjectStatusSerializer(serializers.ModelSerializer):
+    """
+    A project's totals and how many of its items are under, close to and
+    over their estimate. Expects projects annotated by
+    with_item_status_counts.
+    """
+    items_close = serializers.IntegerField(read_only=True)
+    items_over = serializers.IntegerField(read_only=True)
+    items_under = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Project
+        fields = ('id', 'name', 'estimated', 'actual', 'archived', 'items_under', 'items_close', 'items_over')
+
+
+class ProjectTreeSerializer(ProjectSerializer):
+    class JSONAPIMeta:
+        included_resources = ['categories', 'categories.items']
+
+
+class ProjectCloneSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=200, required=False)
+    reset_actual = serializers.BooleanField(default=False)
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'project', 'team', 'provider', 'status', 'attempts', 'changed_items', 'error',
+                  'created_at', 'started_at', 'finished_at')
@@ -0,0 +1,8 @@
+import django.dispatch
+
+
+project_imported = django.dispatch.Signal(providing_args=["project"])
+
+# Sent when a single item is deleted. Items have no delete receivers, so
+# that deleting their category deletes them with a single query.
+item_deleted = django.dispatch.Signal(providing_args=["item"])
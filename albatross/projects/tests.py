@@ -1,16 +1,33 @@
 from decimal import Decimal
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.contrib.auth.models import User
 from rest_framework.test import APITestCase, APIClient
 from django.urls import reverse
+from datetime import timedelta
+from io import StringIO
 import json
+import mock
+import threading
 
 from django.contrib.auth import get_user_model
-from .models import Project, Category, Item
+from .cache import get_project_list_stats, reset_project_list_stats
+from .jobs import claim_import_job, extend_lease, finish_import_job, run_import_job, run_import_jobs
+from .imports import finish_import, get_import_window, save_time_entries, update_actuals
+from .models import Project, Category, ImportJob, Item, ProviderProjectLink, TimeEntry
+from .signals import project_imported
 from teams.models import Team
+from toggl.hooks import hookset as toggl_hookset
 
 UserModel = get_user_model()
 
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 
 class CategoryModelTestCase(TestCase):
     @classmethod
@@ -110,6 +127,267 @@ class ProjectModelTestCases(TestCase):
         project.buffer = 20
         self.assertEqual(project.estimated, Decimal("32.4"))
 
+    def test_clone_copies_categories_and_items(self):
+        project = Project.objects.get(name='My Project')
+        project.buffer = 10
+        project.save()
+        category_backend = Category.objects.create(name='Backend', project=project)
+        Category.objects.create(name='Frontend', project=project)
+        Item.objects.create(description='Deployment', actual=5, estimated=20, category=category_backend)
+        Item.objects.create(description='Database', actual=3, estimated=4, category=category_backend)
+
+        clone = project.clone('Copy')
+        self.assertNotEqual(clone.id, project.id)
+        self.assertEqual(clone.buffer, 10)
+        self.assertEqual(clone.actual, 8)
+        self.assertEqual(clone.estimated, Decimal("26.4"))
+        self.assertEqual(list(clone.categories.order_by('name').values_list('name', flat=True)),
+                         ['Backend', 'Frontend'])
+        backend_copy = clone.categories.get(name='Backend')
+        self.assertEqual(backend_copy.actual, 8)
+        self.assertEqual(backend_copy.estimated, 24)
+        self.assertEqual(backend_copy.items.count(), 2)
+        self.assertEqual(project.categories.get(name='Backend').items.count(), 2)
+
+    def test_clone_reset_actual(self):
+        project = Project.objects.get(name='My Project')
+        category = Category.objects.create(name='Backend', project=project)
+        Item.objects.create(description='Deployment', actual=5, estimated=20, category=category)
+
+        clone = project.clone('Copy', reset_actual=True)
+        self.assertEqual(clone.actual, 0)
+        self.assertEqual(clone.estimated, 20)
+        self.assertEqual(clone.categories.get().actual, 0)
+        self.assertEqual(Item.objects.get(category__project=clone).actual, 0)
+
+
+class RollupTestCases(TestCase):
+    def setUp(self):
+        user = UserModel.objects.create(
+            email='test5@test.com',
+            first_name='Tester',
+            last_name='Account',
+            password='password125',
+            username='test5@test.com'
+        )
+        team = Team.objects.create(name='Krit', creator=user)
+        self.project = Project.objects.create(name='My Project', team=team)
+        self.backend = Category.objects.create(name='Backend', project=self.project)
+        self.frontend = Category.objects.create(name='Frontend', project=self.project)
+        self.item = Item.objects.create(description='Deployment', actual=5, estimated=20, category=self.backend)
+        Item.objects.create(description='User Page', actual=2, estimated=7, category=self.frontend)
+
+    def test_rollups_are_stored(self):
+        project = Project.objects.get(id=self.project.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(project.actual, 7)
+            self.assertEqual(project.estimated, 27)
+
+    def test_update_item_updates_rollups(self):
+        item = Item.objects.get(id=self.item.id)
+        item.actual = 8
+        item.save()
+
+        self.assertEqual(Category.objects.get(id=self.backend.id).actual, 8)
+        self.assertEqual(Project.objects.get(id=self.project.id).actual, 10)
+
+    def test_move_item_updates_rollups(self):
+        item = Item.objects.get(id=self.item.id)
+        item.category = self.frontend
+        item.save()
+
+        self.assertEqual(Category.objects.get(id=self.backend.id).estimated, 0)
+        self.assertEqual(Category.objects.get(id=self.frontend.id).estimated, 27)
+        self.assertEqual(Project.objects.get(id=self.project.id).estimated, 27)
+
+    def test_refreshed_item_updates_rollups(self):
+        item = Item.objects.create(description='Settings', actual=0, estimated=3, category=self.backend)
+        Item.objects.filter(id=item.id).update(actual=2)
+        self.project.refresh_rollups()
+        item.refresh_from_db()
+        item.description = 'Preferences'
+        item.save()
+
+        self.assertEqual(Category.objects.get(id=self.backend.id).actual, 7)
+        self.assertEqual(Project.objects.get(id=self.project.id).actual, 9)
+
+    def test_saving_stale_item_keeps_rollups(self):
+        stale_item = Item.objects.get(id=self.item.id)
+        item = Item.objects.get(id=self.item.id)
+        item.actual = 8
+        item.save()
+        # The stale copy writes its actual of 5 back
+        stale_item.estimated = 25
+        stale_item.save()
+
+        backend = Category.objects.get(id=self.backend.id)
+        self.assertEqual((backend.actual, backend.estimated), (5, 25))
+        self.assertEqual(Project.objects.get(id=self.project.id).actual, 7)
+
+    def test_delete_item_updates_rollups(self):
+        Item.objects.get(id=self.item.id).delete()
+
+        self.assertEqual(Category.objects.get(id=self.backend.id).actual, 0)
+        self.assertEqual(Project.objects.get(id=self.project.id).actual, 2)
+
+    def test_delete_stale_item_updates_rollups(self):
+        stale_item = Item.objects.get(id=self.item.id)
+        item = Item.objects.get(id=self.item.id)
+        item.actual = 8
+        item.save()
+        stale_item.delete()
+
+        self.assertEqual(Category.objects.get(id=self.backend.id).actual, 0)
+        self.assertEqual(Project.objects.get(id=self.project.id).actual, 2)
+
+    def test_delete_category_updates_rollups(self):
+        Category.objects.get(id=self.frontend.id).delete()
+
+        project = Project.objects.get(id=self.project.id)
+        self.assertEqual(project.actual, 5)
+        self.assertEqual(project.estimated, 20)
+
+    @override_settings(CACHES=DUMMY_CACHES)
+    def test_delete_category_query_count(self):
+        for index in range(50):
+            Item.objects.create(description='Item {}'.format(index), actual=1, estimated=1, category=self.backend)
+        backend = Category.objects.get(id=self.backend.id)
+
+        # totals, project update and one delete each for the items and the category
+        with self.assertNumQueries(4):
+            backend.delete()
+        self.assertEqual(Project.objects.get(id=self.project.id).actual, 2)
+
+    def test_saving_stale_project_keeps_rollups(self):
+        stale_project = Project.objects.get(id=self.project.id)
+        Item.objects.create(description='Settings', actual=1, estimated=3, category=self.backend)
+        stale_project.name = 'Renamed'
+        stale_project.save()
+
+        self.assertEqual(Project.objects.get(id=self.project.id).estimated, 30)
+
+    def test_rebuild_rollups_command(self):
+        Project.objects.filter(id=self.project.id).update(total_actual=100)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(Project.objects.get(id=self.project.id).actual, 7)
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+
+@override_settings(IMPORT_SETTLE_DAYS=7)
+class ImportTestCases(TestCase):
+    def setUp(self):
+        user = UserModel.objects.create(email='import@test.com', username='import@test.com')
+        self.project = Project.objects.create(name='My Project', team=Team.objects.create(name='Team', creator=user))
+        category = Category.objects.create(name='Backend', project=self.project)
+        self.item = Item.objects.create(description='Deployment', actual=0, estimated=20, category=category)
+        self.today = timezone.now().date()
+
+    def import_entries(self, entries, since=None):
+        time_entries = [
+            TimeEntry(category_name=category_name, description=description, hours=hours,
+                      provider_entry_id=entry_id, spent_on=self.today - timedelta(days=days_ago))
+            for entry_id, category_name, description, hours, days_ago in entries
+        ]
+        save_time_entries(self.project, ProviderProjectLink.TOGGL, time_entries, since)
+        update_actuals(self.project, ProviderProjectLink.TOGGL)
+        self.item.refresh_from_db()
+
+    def test_import_window(self):
+        self.assertIsNone(get_import_window(self.project))
+        self.project.last_imported_date = timezone.now()
+        self.assertIsNone(get_import_window(self.project))
+        self.import_entries([(1, 'backend', 'deployment', Decimal('2'), 30)])
+        self.assertEqual(get_import_window(self.project), self.today - timedelta(days=7))
+        self.assertIsNone(get_import_window(self.project, reconcile=True))
+
+    def test_actual_is_added_up_from_the_ledger(self):
+        self.import_entries([
+            (1, 'backend', 'Deployment', Decimal('2'), 30),
+            (2, 'Backend', 'deployment', Decimal('1.25'), 3),
+            (3, 'backend', 'Other', Decimal('100'), 1)
+        ])
+        self.assertEqual(self.item.actual, Decimal('3.25'))
+        self.assertEqual(Category.objects.get(name='Backend').actual, Decimal('3.25'))
+
+    def test_incremental_import_replaces_the_window(self):
+        self.import_entries([
+            (1, 'backend', 'deployment', Decimal('2'), 30),
+            (2, 'backend', 'deployment', Decimal('1'), 3),
+            (3, 'backend', 'deployment', Decimal('4'), 2)
+        ])
+        # Entry 2 was edited and entry 3 deleted since the last import
+        self.import_entries([
+            (2, 'backend', 'deployment', Decimal('1.5'), 3),
+            (4, 'backend', 'deployment', Decimal('1'), 0)
+        ], since=self.today - timedelta(days=7))
+        self.assertEqual(self.item.actual, Decimal('4.5'))
+        self.assertEqual(TimeEntry.objects.filter(project=self.project).count(), 3)
+
+    def test_entries_moved_into_the_window_replace_the_stored_copy(self):
+        self.import_entries([(1, 'backend', 'deployment', Decimal('2'), 30)])
+        # Entry 1 was moved to today, and shows up on two report pages
+        self.import_entries([
+            (1, 'backend', 'deployment', Decimal('2'), 0),
+            (1, 'backend', 'deployment', Decimal('2.5'), 0)
+        ], since=self.today - timedelta(days=7))
+        self.assertEqual(self.item.actual, Decimal('2.5'))
+        self.assertEqual(TimeEntry.objects.get(project=self.project).spent_on, self.today)
+
+    def test_only_changed_items_are_written(self):
+        other_item = Item.objects.create(description='Tests', actual=0, estimated=5, category=self.item.category)
+        self.import_entries([(1, 'backend', 'deployment', Decimal('2'), 3)])
+        updated_at = self.item.updated_at
+
+        time_entries = [TimeEntry(category_name='backend', description='tests', hours=Decimal('1'),
+                                  provider_entry_id=2, spent_on=self.today)]
+        save_time_entries(self.project, ProviderProjectLink.TOGGL, time_entries, since=self.today)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(update_actuals(self.project, ProviderProjectLink.TOGGL), 1)
+        item_updates = [query for query in queries.captured_queries
+                        if query['sql'].startswith('UPDATE "projects_item"')]
+        self.assertEqual(len(item_updates), 1)
+        self.assertEqual(update_actuals(self.project, ProviderProjectLink.TOGGL), 0)
+
+        self.item.refresh_from_db()
+        other_item.refresh_from_db()
+        self.assertEqual(self.item.updated_at, updated_at)
+        self.assertEqual(other_item.actual, 1)
+        self.assertEqual(self.project.total_actual, 3)
+
+    def test_import_is_committed_under_row_locks(self):
+        time_entries = [TimeEntry(category_name='backend', description='deployment', hours=Decimal('2'),
+                                  provider_entry_id=1, spent_on=self.today)]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(finish_import(self.project, ProviderProjectLink.TOGGL, time_entries), 1)
+        locks = [query['sql'] for query in queries.captured_queries if query['sql'].endswith('FOR UPDATE')]
+        self.assertTrue(locks[0].startswith('SELECT (1) AS "a" FROM "projects_project"'))
+        self.assertIn('FROM "projects_item"', locks[1])
+        self.assertIsNotNone(Project.objects.get(pk=self.project.pk).last_imported_date)
+
+    def test_import_keeps_concurrent_project_changes(self):
+        # The project is renamed while its entries are being fetched
+        Project.objects.filter(pk=self.project.pk).update(name='Renamed')
+        finish_import(self.project, ProviderProjectLink.TOGGL, [])
+        project = Project.objects.get(pk=self.project.pk)
+        self.assertEqual(project.name, 'Renamed')
+        self.assertIsNotNone(project.last_imported_date)
+
+    def test_renamed_items_are_matched_from_the_ledger(self):
+        self.import_entries([
+            (1, 'backend', 'deployment', Decimal('2'), 30),
+            (2, 'backend', 'deploy', Decimal('3'), 3)
+        ])
+        self.assertEqual(self.item.actual, 2)
+
+        self.item.description = 'Deploy'
+        self.item.save()
+        update_actuals(self.project, ProviderProjectLink.TOGGL)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.actual, 3)
+
 
 class ProjectViewTests(APITestCase):
     @classmethod
@@ -140,6 +418,13 @@ class ProjectViewTests(APITestCase):
         response = client.get(reverse('project-list'))
         self.assertEqual(response.status_code, 401)
 
+    def test_projects_response_without_team(self):
+        user = User.objects.create_user(email='noteam@test.com', password='password125', username='noteam@test.com')
+        self.client.force_authenticate(user=user)
+        response = self.client.get(reverse('project-list'), {'page[size]': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['data'], [])
+
     def test_unauthenticated_user_create_project_response(self):
         client = APIClient()
         data = {
@@ -187,6 +472,118 @@ class ProjectViewTests(APITestCase):
         self.assertEqual(project_attributes['estimated'], 0)
         self.assertEqual(project_attributes['actual'], 0)
 
+    @override_settings(CACHES=DUMMY_CACHES)
+    def test_projects_response_query_count(self):
+        '''
+        GET /projects/
+        '''
+        team = Team.objects.get(name='Kritters')
+        for index in range(5):
+            project = Project.objects.create(name='Project {}'.format(index), team=team)
+            category = Category.objects.create(name='Design', project=project)
+            Item.objects.create(description='Login', estimated=10, actual=2, category=category)
+
+        # Membership, projects and their category ids
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('project-list'))
+        self.assertEqual(response.status_code, 200)
+
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(json_response['data']), 5)
+        for project_data in json_response['data']:
+            self.assertEqual(len(project_data['relationships']['categories']['data']), 1)
+            self.assertEqual(project_data['attributes']['actual'], 2)
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_projects_response_is_cached(self):
+        '''
+        GET /projects/
+        '''
+        project = Project.objects.create(name='My Project', team=Team.objects.get(name='Kritters'))
+        category = Category.objects.create(name='Design', project=project)
+        item = Item.objects.create(description='Login', estimated=10, actual=2, category=category)
+        reset_project_list_stats()
+
+        response = self.client.get(reverse('project-list'))
+        self.assertEqual(get_project_list_stats(), {'hits': 0, 'misses': 1})
+
+        # Only the membership is looked up on a hit
+        with self.assertNumQueries(1):
+            cached_response = self.client.get(reverse('project-list'))
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(get_project_list_stats(), {'hits': 1, 'misses': 1})
+
+        # Other query strings are cached separately
+        self.client.get(reverse('project-list') + '?fields[projects]=name')
+        self.assertEqual(get_project_list_stats(), {'hits': 1, 'misses': 2})
+
+        # Changing an item invalidates the team's cached lists
+        item.actual = 7
+        item.save()
+        response = self.client.get(reverse('project-list'))
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(json_response['data'][0]['attributes']['actual'], 7)
+        self.assertEqual(get_project_list_stats(), {'hits': 1, 'misses': 3})
+
+        # So does an import finishing
+        project_imported.send(sender=Project, project=project)
+        self.client.get(reverse('project-list'))
+        self.assertEqual(get_project_list_stats(), {'hits': 1, 'misses': 4})
+
+        # And deleting an item or a category
+        Item.objects.create(description='Logout', estimated=1, actual=1, category=category).delete()
+        self.client.get(reverse('project-list'))
+        self.assertEqual(get_project_list_stats(), {'hits': 1, 'misses': 5})
+        category.delete()
+        response = self.client.get(reverse('project-list'))
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(json_response['data'][0]['attributes']['actual'], 0)
+        self.assertEqual(get_project_list_stats(), {'hits': 1, 'misses': 6})
+
+    @override_settings(CACHES=DUMMY_CACHES)
+    def test_projects_sparse_fieldset(self):
+        '''
+        GET /projects/?fields[projects]=name,archived
+        '''
+        team = Team.objects.get(name='Kritters')
+        for index in range(3):
+            project = Project.objects.create(name='Project {}'.format(index), team=team)
+            Category.objects.create(name='Design', project=project)
+
+        # Membership and projects, without their categories
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('project-list') + '?fields[projects]=name,archived')
+        self.assertEqual(response.status_code, 200)
+
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(json_response['data']), 3)
+        for project_data in json_response['data']:
+            self.assertEqual(set(project_data['attributes']), {'name', 'archived'})
+            self.assertNotIn('relationships', project_data)
+
+    @override_settings(CACHES=DUMMY_CACHES)
+    def test_projects_include_categories(self):
+        '''
+        GET /projects/?include=categories
+        '''
+        team = Team.objects.get(name='Kritters')
+        for index in range(3):
+            project = Project.objects.create(name='Project {}'.format(index), team=team)
+            category = Category.objects.create(name='Design', project=project)
+            Item.objects.create(description='Login', estimated=10, actual=2, category=category)
+
+        # Membership, projects, categories and their item ids
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('project-list') + '?include=categories')
+        self.assertEqual(response.status_code, 200)
+
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(json_response['data']), 3)
+        self.assertEqual(len(json_response['included']), 3)
+        for category_data in json_response['included']:
+            self.assertEqual(category_data['type'], 'categories')
+            self.assertEqual(len(category_data['relationships']['items']['data']), 1)
+
     def test_projects_response_only_returns_own_projects(self):
         '''
         GET /projects/
@@ -240,6 +637,59 @@ class ProjectViewTests(APITestCase):
         self.assertEqual(project_attributes['actual'], 5)
         self.assertEqual(project_attributes['buffer'], 10)
 
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_get_project_tree(self):
+        '''
+        GET /projects/:id/tree/
+        '''
+
+        project = Project.objects.create(name='My Project', team=Team.objects.get(name='Kritters'))
+        for index in range(3):
+            category = Category.objects.create(name='Category {}'.format(index), project=project)
+            Item.objects.create(description='Login', estimated=10, actual=2, category=category)
+            Item.objects.create(description='Settings', estimated=10, actual=3, category=category)
+
+        # Membership, the cache key, and the project with its categories and items
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('project-tree', args=(project.id,)))
+        self.assertEqual(response.status_code, 200)
+
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(json_response['data']['id'], str(project.id))
+        self.assertEqual(json_response['data']['attributes']['actual'], 15)
+        self.assertEqual(len(json_response['data']['relationships']['categories']['data']), 3)
+        included_types = [resource['type'] for resource in json_response['included']]
+        self.assertEqual(included_types.count('categories'), 3)
+        self.assertEqual(included_types.count('items'), 6)
+
+        # The second request is served from the cache
+        with self.assertNumQueries(2):
+            cached_response = self.client.get(reverse('project-tree', args=(project.id,)))
+        self.assertEqual(cached_response.content, response.content)
+
+        # Sparse fieldsets aren't served the whole cached document
+        response = self.client.get(reverse('project-tree', args=(project.id,)), {'fields[projects]': 'name'})
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(list(json_response['data']['attributes']), ['name'])
+
+        # Removing an item invalidates it
+        Item.objects.filter(category=category).first().delete()
+        response = self.client.get(reverse('project-tree', args=(project.id,)))
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(json_response['data']['attributes']['actual'], 13)
+        included_types = [resource['type'] for resource in json_response['included']]
+        self.assertEqual(included_types.count('items'), 5)
+
+    def test_get_other_teams_project_tree(self):
+        '''
+        GET /projects/:id/tree/
+        '''
+
+        team = Team.objects.get(name='Krit', creator__email='test3@test.com')
+        project = Project.objects.create(name='My Project', team=team)
+        response = self.client.get(reverse('project-tree', args=(project.id,)))
+        self.assertEqual(response.status_code, 404)
+
     def test_no_project_found(self):
         '''
         /GET projects/:id
@@ -411,6 +861,241 @@ class ProjectViewTests(APITestCase):
                                                    'Harvest or provide ' \
                                                    'a Toggl API key.'
 
+    def test_project_status(self):
+        project = Project.objects.create(name='My Project', team=Team.objects.get(name='Kritters'))
+        category = Category.objects.create(name='Backend', project=project)
+        for actual, estimated in ((1, 10), (9.5, 10), (12, 10), (11, 10)):
+            Item.objects.create(description='Item', actual=actual, estimated=estimated, category=category)
+        Project.objects.create(name='Empty Project', team=Team.objects.get(name='Kritters'))
+        other_user = UserModel.objects.create(email='status@test.com', username='status@test.com')
+        Project.objects.create(name='Other Project', team=Team.objects.create(name='Other Team', creator=other_user))
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('project-status'))
+        self.assertEqual(response.status_code, 200)
+        data = {project['attributes']['name']: project['attributes']
+                for project in json.loads(response.content.decode('utf-8'))['data']}
+        self.assertEqual(set(data), {'My Project', 'Empty Project'})
+        self.assertEqual(data['My Project']['items_under'], 1)
+        self.assertEqual(data['My Project']['items_close'], 1)
+        self.assertEqual(data['My Project']['items_over'], 2)
+        self.assertEqual(data['My Project']['actual'], 33.5)
+        self.assertEqual(data['Empty Project']['items_under'], 0)
+
+    @override_settings(CACHES=DUMMY_CACHES)
+    def test_clone_project(self):
+        project = Project.objects.create(name='My Project', team=Team.objects.get(name='Kritters'))
+        category = Category.objects.create(name='Design', project=project)
+        for i in range(10):
+            Item.objects.create(description='Item {}'.format(i), actual=1, estimated=2, category=category)
+
+        data = {
+            'data': {
+                'attributes': {
+                    'name': 'My Template',
+                    'reset-actual': True
+                },
+                'type': 'projects'
+            }
+        }
+        with self.assertNumQueries(11):
+            response = self.client.post(reverse('project-clone', args=(project.id,)),
+                                        data=json.dumps(data),
+                                        content_type='application/vnd.api+json')
+        self.assertEqual(response.status_code, 201)
+
+        json_data = json.loads(response.content.decode('utf-8'))
+        clone = Project.objects.get(id=json_data['data']['id'])
+        self.assertEqual(json_data['data']['attributes']['name'], 'My Template')
+        self.assertEqual(json_data['data']['attributes']['estimated'], 20)
+        self.assertEqual(json_data['data']['attributes']['actual'], 0)
+        self.assertEqual(len(json_data['data']['relationships']['categories']['data']), 1)
+        self.assertEqual(Item.objects.filter(category__project=clone, actual=0).count(), 10)
+
+    def test_clone_project_default_name(self):
+        project = Project.objects.create(name='My Project', team=Team.objects.get(name='Kritters'))
+        response = self.client.post(reverse('project-clone', args=(project.id,)))
+        self.assertEqual(response.status_code, 201)
+        json_data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(json_data['data']['attributes']['name'], 'My Project (copy)')
+
+    def test_clone_other_teams_project(self):
+        team = Team.objects.get(name='Krit', creator__email='test3@test.com')
+        project = Project.objects.create(name='My Project', team=team)
+        response = self.client.post(reverse('project-clone', args=(project.id,)))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Project.objects.filter(team=team).count(), 1)
+
+
+class ImportJobViewTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='jobs@test.com', password='password125', username='jobs@test.com')
+        self.user.profile.toggl_api_key = '123'
+        self.user.profile.save()
+        self.project = Project.objects.create(name='My Project', team=Team.objects.create(name='Team', creator=self.user))
+        self.client.force_authenticate(user=self.user)
+
+    def queue_import(self):
+        response = self.client.post(reverse('project-update-actual-time', args=(self.project.id,)))
+        self.assertEqual(response.status_code, 202)
+        return response
+
+    def get_job(self, job_id):
+        response = self.client.get(reverse('import-job-detail', args=(job_id,)))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))['data']
+
+    def test_update_actual_time_queues_a_job(self):
+        response = self.queue_import()
+        data = json.loads(response.content.decode('utf-8'))['data']
+        self.assertEqual(data['type'], 'import-jobs')
+        self.assertEqual(data['attributes']['status'], ImportJob.QUEUED)
+        self.assertTrue(response['Location'].endswith(reverse('import-job-detail', args=(data['id'],))))
+
+        # Clicking again while the job is waiting doesn't queue another one
+        response = self.queue_import()
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['data']['id'], data['id'])
+        self.assertEqual(ImportJob.objects.count(), 1)
+
+    def test_worker_runs_queued_jobs(self):
+        job_id = json.loads(self.queue_import().content.decode('utf-8'))['data']['id']
+        with mock.patch.object(Project, 'update_actual', return_value=3) as update_actual:
+            run_import_jobs()
+        self.assertEqual(update_actual.call_args[0], ('123', toggl_hookset))
+
+        data = self.get_job(job_id)
+        self.assertEqual(data['attributes']['status'], ImportJob.SUCCEEDED)
+        self.assertEqual(data['attributes']['changed_items'], 3)
+        self.assertIsNotNone(data['attributes']['finished_at'])
+
+        # Once the job is done, importing again queues a new one
+        self.assertNotEqual(json.loads(self.queue_import().content.decode('utf-8'))['data']['id'], job_id)
+
+    @override_settings(IMPORT_JOB_RETRY_DELAY_SECONDS=0)
+    def test_failed_import(self):
+        job_id = json.loads(self.queue_import().content.decode('utf-8'))['data']['id']
+        with mock.patch.object(Project, 'update_actual', side_effect=ValueError('Toggl is down')):
+            run_import_jobs()
+
+        data = self.get_job(job_id)
+        self.assertEqual(data['attributes']['status'], ImportJob.FAILED)
+        self.assertEqual(data['attributes']['error'], 'Toggl is down')
+
+    def test_other_teams_jobs_are_not_found(self):
+        job = ImportJob.objects.create(project=self.project, requested_by=self.user)
+        other_user = User.objects.create_user(email='other@test.com', password='password125', username='other@test.com')
+        Team.objects.create(name='Other Team', creator=other_user)
+        self.client.force_authenticate(user=other_user)
+        response = self.client.get(reverse('import-job-detail', args=(job.id,)))
+        self.assertEqual(response.status_code, 404)
+
+
+class ImportJobQueueTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='queue@test.com', password='password125', username='queue@test.com')
+        self.team = Team.objects.create(name='Team', creator=user)
+        self.now = timezone.now()
+
+    def create_job(self, provider=ProviderProjectLink.TOGGL, **kwargs):
+        return ImportJob.objects.create(team=self.team, provider=provider, **kwargs)
+
+    def test_jobs_are_claimed_with_skip_locked(self):
+        job = self.create_job()
+        with CaptureQueriesContext(connection) as queries:
+            claimed = claim_import_job()
+        self.assertEqual(claimed, job)
+        self.assertEqual(claimed.status, ImportJob.RUNNING)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertTrue(any(query['sql'].endswith('FOR UPDATE SKIP LOCKED') for query in queries.captured_queries))
+        self.assertIsNone(claim_import_job())
+
+    def test_expired_leases_are_claimed_again(self):
+        job = self.create_job(status=ImportJob.RUNNING, attempts=1, lease_expires_at=self.now - timedelta(minutes=1))
+        self.create_job(status=ImportJob.RUNNING, attempts=1, lease_expires_at=self.now + timedelta(minutes=1))
+
+        claimed = claim_import_job()
+        self.assertEqual(claimed, job)
+        self.assertEqual(claimed.attempts, 2)
+        self.assertGreater(claimed.lease_expires_at, self.now)
+        self.assertIsNone(claim_import_job())
+
+    def test_jobs_out_of_attempts_time_out(self):
+        job = self.create_job(status=ImportJob.RUNNING, attempts=3, lease_expires_at=self.now - timedelta(minutes=1))
+        self.assertIsNone(claim_import_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertEqual(job.error, 'The import timed out.')
+
+    def test_taken_over_jobs_cant_be_finished(self):
+        job = self.create_job()
+        claimed = claim_import_job()
+        # Another worker claims the job after the lease ran out
+        ImportJob.objects.filter(pk=job.pk).update(attempts=2)
+
+        self.assertFalse(finish_import_job(claimed, status=ImportJob.SUCCEEDED))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.RUNNING)
+
+    def test_leases_are_only_extended_by_their_holder(self):
+        job = self.create_job()
+        claimed = claim_import_job()
+        ImportJob.objects.filter(pk=job.pk).update(lease_expires_at=self.now)
+
+        self.assertTrue(extend_lease(claimed))
+        job.refresh_from_db()
+        self.assertGreater(job.lease_expires_at, self.now)
+
+        ImportJob.objects.filter(pk=job.pk).update(attempts=2)
+        self.assertFalse(extend_lease(claimed))
+
+    @override_settings(IMPORT_JOB_HEARTBEAT_SECONDS=0.01)
+    def test_leases_are_extended_while_importing(self):
+        job = self.create_job()
+        heartbeat = threading.Event()
+
+        # The hooksets are called with self=hookset, which MagicMock won't take
+        def import_team(**kwargs):
+            if not heartbeat.wait(5):
+                raise ValueError('The lease was never extended')
+            return 0
+
+        with mock.patch('projects.jobs.extend_lease', side_effect=lambda job: heartbeat.set() or True), \
+                mock.patch('projects.jobs.get_job_credentials',
+                           return_value=('123', mock.Mock(update_team_line_item_times=import_team))):
+            run_import_job(claim_import_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.SUCCEEDED)
+
+    @override_settings(IMPORT_JOB_RETRY_DELAY_SECONDS=60)
+    def test_failed_jobs_are_tried_again_after_a_delay(self):
+        job = self.create_job()
+
+        def import_team(**kwargs):
+            raise ValueError('Toggl is down')
+
+        hookset = mock.Mock(update_team_line_item_times=import_team)
+        with mock.patch('projects.jobs.get_job_credentials', return_value=('123', hookset)):
+            run_import_job(claim_import_job())
+            job.refresh_from_db()
+            self.assertEqual(job.status, ImportJob.QUEUED)
+            self.assertGreaterEqual(job.not_before, self.now + timedelta(seconds=60))
+            self.assertIsNone(claim_import_job())
+
+            # The delay doubles with every attempt
+            ImportJob.objects.filter(pk=job.pk).update(not_before=self.now)
+            run_import_job(claim_import_job())
+            job.refresh_from_db()
+            self.assertGreaterEqual(job.not_before, self.now + timedelta(seconds=120))
+
+    @override_settings(TOGGL_IMPORT_CONCURRENCY=1)
+    def test_team_imports_are_capped_per_provider(self):
+        self.create_job(status=ImportJob.RUNNING, attempts=1, lease_expires_at=self.now + timedelta(minutes=1))
+        self.create_job()
+        harvest_job = self.create_job(provider=ProviderProjectLink.HARVEST)
+
+        self.assertEqual(claim_import_job(), harvest_job)
+        self.assertIsNone(claim_import_job())
+
 
 class CategoryViewTests(APITestCase):
     def setUp(self):
@@ -493,6 +1178,31 @@ class CategoryViewTests(APITestCase):
         self.assertEqual(category_attributes['estimated'], 20)
         self.assertEqual(category_attributes['actual'], 5)
 
+    def test_categories_included_items_query_count(self):
+        '''
+        GET /categories/
+        '''
+
+        project = Project.objects.get(name='My Project')
+        for index in range(5):
+            category = Category.objects.create(name='Category {}'.format(index), project=project)
+            Item.objects.create(description='Login', estimated=10, actual=2, category=category)
+            Item.objects.create(description='Settings', estimated=10, actual=3, category=category)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('category-list'))
+        self.assertEqual(response.status_code, 200)
+
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(json_response['data']), 6)
+        self.assertEqual(len(json_response['included']), 11)
+        for category_data in json_response['data']:
+            if category_data['attributes']['name'] == 'Frontend':
+                continue
+            self.assertEqual(len(category_data['relationships']['items']['data']), 2)
+            self.assertEqual(category_data['attributes']['estimated'], 20)
+            self.assertEqual(category_data['attributes']['actual'], 5)
+
     def test_change_category_name(self):
         '''
         PATCH /categories/:id
@@ -544,6 +1254,52 @@ class CategoryViewTests(APITestCase):
         self.assertIn(item_users.id, ids)
         self.assertIn(item_settings.id, ids)
 
+    def test_bulk_create_categories(self):
+        '''
+        POST /categories/bulk/
+        '''
+        project = Project.objects.get(name='My Project')
+        data = {
+            'data': [
+                {
+                    'attributes': {'name': name},
+                    'relationships': {'project': {'data': {'type': 'projects', 'id': project.id}}},
+                    'type': 'categories'
+                }
+                for name in ('Design', 'Backend')
+            ]
+        }
+        response = self.client.post(reverse('category-bulk'),
+                                    data=json.dumps(data),
+                                    content_type='application/vnd.api+json')
+        self.assertEqual(response.status_code, 201)
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([category['attributes']['name'] for category in json_response['data']],
+                         ['Design', 'Backend'])
+        self.assertEqual(project.categories.count(), 3)
+
+    @override_settings(CACHES=DUMMY_CACHES)
+    def test_bulk_delete_categories(self):
+        '''
+        DELETE /categories/bulk/
+        '''
+        project = Project.objects.get(name='My Project')
+        category = Category.objects.get(name='Frontend')
+        for index in range(50):
+            Item.objects.create(description='Item {}'.format(index), actual=1, estimated=1, category=category)
+        data = {'data': [{'type': 'categories', 'id': category.id}]}
+
+        # membership, categories, savepoint, items, categories, rollups (2), release
+        with self.assertNumQueries(8):
+            response = self.client.delete(reverse('category-bulk'),
+                                          data=json.dumps(data),
+                                          content_type='application/vnd.api+json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Item.objects.count(), 0)
+        project.refresh_from_db()
+        self.assertEqual(project.actual, 0)
+        self.assertEqual(project.estimated, 0)
+
 
 class ItemViewTests(APITestCase):
     CATEGORY_NAME = 'Frontend'
@@ -564,6 +1320,66 @@ class ItemViewTests(APITestCase):
         category = Category.objects.create(name=self.CATEGORY_NAME, project=project)
         Item.objects.create(description=self.ITEM_DESCRIPTION, actual=5, estimated=20, category=category)
 
+    def test_items_response_without_page_is_not_paginated(self):
+        '''
+        GET /items/
+        '''
+        response = self.client.get(reverse('item-list'))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(json_response['data']), 1)
+        self.assertNotIn('links', json_response)
+
+    def test_items_cursor_pagination(self):
+        '''
+        GET /items/?page[size]=2
+        '''
+        category = Category.objects.get(name=self.CATEGORY_NAME)
+        for index in range(4):
+            Item.objects.create(description='Item {}'.format(index), actual=0, estimated=1, category=category)
+        # Touching an item moves it to the end of the list
+        first_item = Item.objects.get(description=self.ITEM_DESCRIPTION)
+        first_item.save()
+
+        ids = []
+        url = reverse('item-list') + '?page[size]=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            json_response = json.loads(response.content.decode('utf-8'))
+            self.assertLessEqual(len(json_response['data']), 2)
+            ids += [int(item_data['id']) for item_data in json_response['data']]
+            url = json_response['links']['next']
+
+        expected_ids = list(Item.objects.order_by('updated_at', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected_ids)
+        self.assertEqual(ids[-1], first_item.id)
+
+    def test_items_query_count(self):
+        '''
+        GET /items/
+        '''
+        category = Category.objects.get(name=self.CATEGORY_NAME)
+        for index in range(4):
+            Item.objects.create(description='Item {}'.format(index), actual=0, estimated=1, category=category)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('item-list'))
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('item-list') + '?fields[items]=description')
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(json_response['data']), 5)
+        self.assertEqual(set(json_response['data'][0]['attributes']), {'description'})
+
+    def test_items_invalid_cursor(self):
+        '''
+        GET /items/?page[cursor]=invalid
+        '''
+        response = self.client.get(reverse('item-list') + '?page[cursor]=invalid')
+        self.assertEqual(response.status_code, 404)
+
     def test_unauthenticated_user_category_response(self):
         client = APIClient()
         response = client.get(reverse('item-detail', args=(1,)))
@@ -603,6 +1419,7 @@ class ItemViewTests(APITestCase):
         item_data = json_response['data']
         self.assertEqual(Item.objects.get(id=item_data['id']).description, 'Login')
         self.assertEqual(category.items.all().count(), 2)
+        category.refresh_from_db()
         self.assertEqual(category.estimated, 25)
         self.assertEqual(category.actual, 5)
 
@@ -663,3 +1480,104 @@ class ItemViewTests(APITestCase):
         self.assertEqual(Item.objects.get(id=item.id).estimated, 30)
         self.assertEqual(Category.objects.get(name=self.CATEGORY_NAME).estimated, 30)
         self.assertEqual(Project.objects.get(name=self.PROJECT_NAME).estimated, 30)
+
+    def bulk_request(self, method, rows):
+        data = {'data': [dict(row, type='items') for row in rows]}
+        return getattr(self.client, method)(reverse('item-bulk'),
+                                            data=json.dumps(data),
+                                            content_type='application/vnd.api+json')
+
+    def test_bulk_create_items(self):
+        '''
+        POST /items/bulk/
+        '''
+        category = Category.objects.get(name=self.CATEGORY_NAME)
+        relationships = {'category': {'data': {'type': 'categories', 'id': category.id}}}
+        response = self.bulk_request('post', [
+            {'attributes': {'description': 'Signup', 'actual': 1, 'estimated': 3}, 'relationships': relationships},
+            {'attributes': {'description': 'Logout', 'actual': 2, 'estimated': 4}, 'relationships': relationships}
+        ])
+        self.assertEqual(response.status_code, 201)
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([item['attributes']['description'] for item in json_response['data']],
+                         ['Signup', 'Logout'])
+        category.refresh_from_db()
+        self.assertEqual(category.items.count(), 3)
+        self.assertEqual(category.actual, 8)
+        self.assertEqual(category.project.estimated, 27)
+
+    @override_settings(CACHES=DUMMY_CACHES)
+    def test_bulk_update_items(self):
+        '''
+        PATCH /items/bulk/
+        '''
+        category = Category.objects.get(name=self.CATEGORY_NAME)
+        for index in range(20):
+            Item.objects.create(description='Item {}'.format(index), actual=0, estimated=1, category=category)
+        items = list(Item.objects.order_by('id'))
+
+        # membership, items, savepoint, update, rollups (2), release, items again
+        with self.assertNumQueries(8):
+            response = self.bulk_request('patch', [
+                {'id': item.id, 'attributes': {'actual': 2}} for item in items
+            ])
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([int(item['id']) for item in json_response['data']], [item.id for item in items])
+        self.assertEqual(Item.objects.filter(actual=2).count(), 21)
+        self.assertEqual(Item.objects.get(description=self.ITEM_DESCRIPTION).estimated, 20)
+        category.refresh_from_db()
+        self.assertEqual(category.actual, 42)
+        self.assertEqual(category.estimated, 40)
+
+    def test_bulk_update_moves_items(self):
+        category = Category.objects.get(name=self.CATEGORY_NAME)
+        backend = Category.objects.create(name='Backend', project=category.project)
+        item = Item.objects.get(description=self.ITEM_DESCRIPTION)
+        response = self.bulk_request('patch', [
+            {'id': item.id, 'relationships': {'category': {'data': {'type': 'categories', 'id': backend.id}}}}
+        ])
+        self.assertEqual(response.status_code, 200)
+        item.refresh_from_db()
+        backend.refresh_from_db()
+        self.assertEqual(item.category_id, backend.id)
+        self.assertEqual(backend.actual, 5)
+        self.assertEqual(Category.objects.get(pk=category.pk).actual, 0)
+
+    @override_settings(CACHES=DUMMY_CACHES)
+    def test_bulk_delete_items(self):
+        '''
+        DELETE /items/bulk/
+        '''
+        category = Category.objects.get(name=self.CATEGORY_NAME)
+        for index in range(50):
+            Item.objects.create(description='Item {}'.format(index), actual=1, estimated=1, category=category)
+
+        items = list(Item.objects.all())
+
+        # membership, items, savepoint, delete, rollups (2), release
+        with self.assertNumQueries(7):
+            response = self.bulk_request('delete', [{'id': item.id} for item in items])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Item.objects.count(), 0)
+        self.assertEqual(Project.objects.get(name=self.PROJECT_NAME).actual, 0)
+
+    def test_bulk_update_is_atomic(self):
+        item = Item.objects.get(description=self.ITEM_DESCRIPTION)
+        response = self.bulk_request('patch', [
+            {'id': item.id, 'attributes': {'actual': 2}},
+            {'id': item.id + 100, 'attributes': {'actual': 2}}
+        ])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Item.objects.get(pk=item.pk).actual, 5)
+
+    def test_bulk_create_items_in_other_teams_category(self):
+        user = UserModel.objects.create(email='other@test.com', username='other@test.com')
+        project = Project.objects.create(name='Other', team=Team.objects.create(name='Other', creator=user))
+        category = Category.objects.create(name='Design', project=project)
+        response = self.bulk_request('post', [{
+            'attributes': {'description': 'Signup', 'actual': 1, 'estimated': 3},
+            'relationships': {'category': {'data': {'type': 'categories', 'id': category.id}}}
+        }])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(category.items.count(), 0)
@@ -2,9 +2,15 @@ from rest_framework.routers import SimpleRouter
 from django.conf.urls import include, url
 
 from .views import (
+    CategoryBulkView,
     CategoryViewSet,
+    ImportJobView,
+    ItemBulkView,
     ItemViewSet,
+    ProjectCloneView,
+    ProjectStatusView,
     ProjectViewSet,
+    ProjectTreeView,
     ProjectUpdateActualTimeView
 )
 
@@ -19,5 +25,47 @@ project_update_actual_time_url = url(
     name="project-update-actual-time"
 )
 
+import_job_url = url(
+    r"^import-jobs/(?P<pk>[0-9]+)/$",
+    ImportJobView.as_view(),
+    name="import-job-detail"
+)
+
+project_status_url = url(
+    r"^projects/status/$",
+    ProjectStatusView.as_view(),
+    name="project-status"
+)
+
+project_tree_url = url(
+    r"^projects/(?P<pk>[0-9]+)/tree/$",
+    ProjectTreeView.as_view(),
+    name="project-tree"
+)
+
+project_clone_url = url(
+    r"^projects/(?P<pk>[0-9]+)/clone/$",
+    ProjectCloneView.as_view(),
+    name="project-clone"
+)
+
+category_bulk_url = url(
+    r"^categories/bulk/$",
+    CategoryBulkView.as_view(),
+    name="category-bulk"
+)
+
+item_bulk_url = url(
+    r"^items/bulk/$",
+    ItemBulkView.as_view(),
+    name="item-bulk"
+)
+
 urlpatterns = router.urls
-urlpatterns.insert(0, project_update_actual_time_url)
\ No newline at end of file
+urlpatterns.insert(0, project_update_actual_time_url)
+urlpatterns.insert(0, project_tree_url)
+urlpatterns.insert(0, project_clone_url)
+urlpatterns.insert(0, category_bulk_url)
+urlpatterns.insert(0, item_bulk_url)
+urlpatterns.insert(0, import_job_url)
+urlpatterns.insert(0, project_status_url)
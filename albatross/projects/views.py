@@ -1,22 +1,59 @@
+import hashlib
+
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.http import HttpResponse
+from django.utils import timezone
 from rest_framework import mixins, permissions, status, viewsets
 from rest_framework.authentication import TokenAuthentication
-from rest_framework.exceptions import ValidationError
-from rest_framework.generics import GenericAPIView
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.generics import GenericAPIView, ListAPIView, RetrieveAPIView
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.parsers import JSONParser
-from harvest.hooks import hookset as harvest_hookset
+from rest_framework_json_api.renderers import JSONRenderer
+from rest_framework_json_api.exceptions import Conflict
+from rest_framework_json_api.utils import get_included_resources, get_resource_type_from_model
 from teams.models import Team, Membership
-from toggl.hooks import hookset as toggl_hookset
 
-from .models import Category, Item, Project
-from .serializers import CategorySerializer, ItemSerializer, ProjectSerializer
+from .cache import get_project_list, invalidate_project_list, set_project_list
+from .jobs import enqueue_import, get_import_credentials
+from .models import Category, ImportJob, Item, Project, bulk_update, rebuild_rollups
+from .pagination import KeysetPagination
+from .parsers import BulkJSONParser
+from .serializers import (
+    CategorySerializer,
+    ImportJobSerializer,
+    ItemSerializer,
+    ProjectCloneSerializer,
+    ProjectSerializer,
+    ProjectStatusSerializer,
+    ProjectTreeSerializer
+)
+
+PROJECT_TREE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class SparseFieldsetsQuerysetMixin(object):
+    """
+    Lets get_queryset only prefetch the relationships a request is going
+    to render, based on its sparse fieldsets and include parameter.
+    """
 
+    def get_included_resources(self):
+        return get_included_resources(self.request, self.get_serializer_class())
 
-class ProjectViewSet(viewsets.ModelViewSet):
+    def is_field_requested(self, resource_name, field_name):
+        fieldset = self.request.query_params.get('fields[{}]'.format(resource_name))
+        return fieldset is None or field_name in fieldset.split(',')
+
+
+class ProjectViewSet(SparseFieldsetsQuerysetMixin, viewsets.ModelViewSet):
     authentication_classes = (TokenAuthentication,)
     included = ['categories']
-    pagination_class = None
+    pagination_class = KeysetPagination
     permission_classes = (permissions.IsAuthenticated,)
     resource_name = 'projects'
     serializer_class = ProjectSerializer
@@ -25,68 +62,395 @@ class ProjectViewSet(viewsets.ModelViewSet):
         membership = Membership.objects.get(user_id=self.request.user.id)
         serializer.save(team=membership.team)
 
+    def get_team_id(self):
+        if not hasattr(self, '_team_id'):
+            try:
+                self._team_id = Membership.objects.values_list('team_id', flat=True) \
+                    .get(user_id=self.request.user.id)
+            except Membership.DoesNotExist:
+                self._team_id = None
+        return self._team_id
+
     def get_queryset(self):
-        try:
-            membership = Membership.objects.get(user_id=self.request.user.id)
-            return membership.team.projects.all()
-        except Membership.DoesNotExist:
-            return []
+        team_id = self.get_team_id()
+        if team_id is None:
+            return Project.objects.none()
+        projects = Project.objects.filter(team_id=team_id)
+
+        included_resources = self.get_included_resources()
+        if any(resource.split('.')[0] == 'categories' for resource in included_resources):
+            categories = Category.objects.all()
+            if ('categories.items' in included_resources
+                    or self.is_field_requested('categories', 'items')):
+                categories = categories.prefetch_related('items')
+            return projects.prefetch_related(Prefetch('categories', queryset=categories))
+        if self.is_field_requested('projects', 'categories'):
+            return projects.with_category_ids()
+        return projects
+
+    def list(self, request, *args, **kwargs):
+        # The rendered json-api document is cached per team and query
+        # string until one of the team's projects, categories or items
+        # changes (see projects.receivers).
+        team_id = self.get_team_id()
+        if team_id is None or not isinstance(request.accepted_renderer, JSONRenderer):
+            return super(ProjectViewSet, self).list(request, *args, **kwargs)
+
+        cache_key, content = get_project_list(team_id, request.get_full_path())
+        if content is not None:
+            return HttpResponse(content, content_type=JSONRenderer.media_type)
+
+        response = super(ProjectViewSet, self).list(request, *args, **kwargs)
+        response = self.finalize_response(request, response, *args, **kwargs)
+        set_project_list(cache_key, response.render().content)
+        return response
 
 
 class ProjectUpdateActualTimeView(GenericAPIView):
+    """
+    Queues an import of the project's hours from Toggl or Harvest and
+    returns the job, whose progress can be followed at its import-job-detail
+    url. A job that's already queued or running for the project is
+    returned instead of queueing another one.
+    """
     authentication_classes = (TokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
     queryset = Project.objects.all()
-    serializer_class = ProjectSerializer
-
-    def get_api_key(self, user_profile):
-        if user_profile.harvest_access_token:
-            tokens = {
-                'access_token': user_profile.harvest_access_token,
-                'refresh_token': user_profile.harvest_refresh_token,
-                'tokens_last_refreshed_at': user_profile.harvest_tokens_last_refreshed_at
-            }
-            return tokens, harvest_hookset
-        elif user_profile.toggl_api_key:
-            return user_profile.toggl_api_key, toggl_hookset
-        else:
-            return None, None
+    resource_name = 'import-jobs'
+    serializer_class = ImportJobSerializer
 
     def post(self, request, *args, **kwargs):
         project = self.get_object()
 
         try:
-            user_profile = self.request.user.profile
-            if not user_profile:
-                raise ObjectDoesNotExist()
-            api_key, hookset = self.get_api_key(user_profile)
-            if not api_key:
-                user_profile = project.team.creator.profile
-                api_key, hookset = self.get_api_key(user_profile)
-                if not api_key:
-                    raise ObjectDoesNotExist()
+            get_import_credentials(request.user, project)
         except ObjectDoesNotExist:
             raise ValidationError('Please login with Harvest or '
                                   'provide a Toggl API key.')
 
-        project.update_actual(api_key, hookset)
-        serializer = self.get_serializer(project)
-        return Response(serializer.data)
+        job = enqueue_import(project, request.user)
+        serializer = self.get_serializer(job)
+        location = reverse('import-job-detail', args=(job.pk,), request=request)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+
+class ImportJobView(RetrieveAPIView):
+    """
+    Reports the status of one of the team's import jobs.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = ImportJobSerializer
+
+    def get_queryset(self):
+        try:
+            membership = Membership.objects.get(user_id=self.request.user.id)
+            return ImportJob.objects.filter(Q(project__team_id=membership.team_id) |
+                                            Q(team_id=membership.team_id))
+        except Membership.DoesNotExist:
+            return ImportJob.objects.none()
+
+
+class ProjectStatusView(ListAPIView):
+    """
+    Lists the team's projects with their totals and how many of their
+    items are under, close to and over their estimate, for dashboards.
+    """
+    authentication_classes = (TokenAuthentication,)
+    pagination_class = KeysetPagination
+    permission_classes = (permissions.IsAuthenticated,)
+    resource_name = 'projects'
+    serializer_class = ProjectStatusSerializer
+
+    def get_queryset(self):
+        try:
+            membership = Membership.objects.get(user_id=self.request.user.id)
+            return Project.objects.filter(team_id=membership.team_id).with_item_status_counts()
+        except Membership.DoesNotExist:
+            return Project.objects.none()
+
+
+class ProjectCloneView(GenericAPIView):
+    """
+    Copies one of the team's projects, with all of its categories and
+    items, into a new project. Pass reset-actual to start the copy with
+    no tracked hours.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    resource_name = 'projects'
+    serializer_class = ProjectSerializer
+
+    def get_queryset(self):
+        try:
+            membership = Membership.objects.get(user_id=self.request.user.id)
+            return Project.objects.filter(team_id=membership.team_id)
+        except Membership.DoesNotExist:
+            return Project.objects.none()
+
+    def post(self, request, *args, **kwargs):
+        project = self.get_object()
+        options = ProjectCloneSerializer(data=request.data)
+        options.is_valid(raise_exception=True)
+
+        name = options.validated_data.get('name') or '{} (copy)'.format(project.name)[:200]
+        clone = project.clone(name, reset_actual=options.validated_data['reset_actual'])
+        clone = Project.objects.with_category_ids().get(pk=clone.pk)
+        serializer = self.get_serializer(clone)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class ProjectTreeView(GenericAPIView):
+    """
+    Returns a project with all of its categories and items as one
+    compound document. The rendered document is cached under a key that
+    changes whenever anything in the project's estimate sheet changes.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    renderer_classes = (JSONRenderer,)
+    resource_name = 'projects'
+    serializer_class = ProjectTreeSerializer
+
+    def get_queryset(self):
+        try:
+            membership = Membership.objects.get(user_id=self.request.user.id)
+            return Project.objects.filter(team_id=membership.team_id).with_tree_version()
+        except Membership.DoesNotExist:
+            return Project.objects.none()
+
+    def get_cache_key(self, project):
+        # Sparse fieldsets and include change the document, so the query
+        # string is part of the key
+        version = '{}:{}:{}:{}:{}:{}'.format(self.request.get_full_path(),
+                                             project.updated_at,
+                                             project.categories_count,
+                                             project.categories_updated_at,
+                                             project.items_count,
+                                             project.items_updated_at)
+        return 'project_{}:tree:{}'.format(project.id,
+                                           hashlib.md5(version.encode('utf-8')).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        project = self.get_object()
+        cache_key = self.get_cache_key(project)
+
+        content = cache.get(cache_key)
+        if content is None:
+            project = Project.objects.with_tree().get(id=project.id)
+            response = self.finalize_response(request, Response(self.get_serializer(project).data),
+                                              *args, **kwargs)
+            content = response.render().content
+            cache.set(cache_key, content, PROJECT_TREE_CACHE_TIMEOUT)
+
+        return HttpResponse(content, content_type=JSONRenderer.media_type)
 
 
-class CategoryViewSet(viewsets.ModelViewSet
-                      ):
+class CategoryViewSet(SparseFieldsetsQuerysetMixin, viewsets.ModelViewSet):
     included = ['items']
-    pagination_class = None
+    pagination_class = KeysetPagination
     permission_classes = (permissions.IsAuthenticated,)
     queryset = Category.objects.all()
     resource_name = 'categories'
     serializer_class = CategorySerializer
 
+    def get_queryset(self):
+        categories = super(CategoryViewSet, self).get_queryset()
+        if self.is_field_requested('categories', 'project'):
+            categories = categories.select_related('project')
+        # The items relationship and the included items both read from the
+        # prefetched items, and each item's category points back at its
+        # prefetched category, so a page of categories costs two queries.
+        if 'items' in self.get_included_resources() or self.is_field_requested('categories', 'items'):
+            categories = categories.prefetch_related('items')
+        return categories
+
 
-class ItemViewSet(viewsets.ModelViewSet):
-    pagination_class = None
+class ItemViewSet(SparseFieldsetsQuerysetMixin, viewsets.ModelViewSet):
+    pagination_class = KeysetPagination
     permission_classes = (permissions.IsAuthenticated,)
     queryset = Item.objects.all()
     resource_name = 'items'
     serializer_class = ItemSerializer
+
+    def get_queryset(self):
+        items = super(ItemViewSet, self).get_queryset()
+        if self.is_field_requested('items', 'category'):
+            items = items.select_related('category')
+        return items
+
+
+class BulkView(GenericAPIView):
+    """
+    Creates (POST), updates (PATCH) or deletes (DELETE) a list of the
+    team's resources in one request and one transaction, following the
+    json-api bulk extension. Rows are written with bulk_create, a single
+    UPDATE and a raw DELETE, which skip projects.receivers, so the rollup
+    totals and the project list cache are refreshed here once per request.
+    """
+    authentication_classes = (TokenAuthentication,)
+    parser_classes = (BulkJSONParser,)
+    permission_classes = (permissions.IsAuthenticated,)
+    # Attributes that can be written through the bulk endpoint
+    bulk_fields = ()
+    parent_field = None
+    parent_model = None
+    # The lookup from the model to the project it belongs to, through its
+    # parent, e.g. 'category__project'
+    project_lookup = None
+
+    def get_team_id(self):
+        if not hasattr(self, '_team_id'):
+            self._team_id = Membership.objects.filter(user_id=self.request.user.id) \
+                .values_list('team_id', flat=True).first()
+        return self._team_id
+
+    def get_parent_projects(self, parent_ids):
+        """
+        Returns a dict mapping the ids of the given parents that belong to
+        the team to the id of their project.
+        """
+        parent_lookup = self.project_lookup.split('__')[1:]
+        parents = self.parent_model.objects.filter(
+            pk__in=parent_ids, **{'__'.join(parent_lookup + ['team_id']): self.get_team_id()})
+        return dict(parents.values_list('pk', '__'.join(parent_lookup + ['id'])))
+
+    def get_project_id(self, instance):
+        path = self.project_lookup.split('__')
+        for field_name in path[:-1]:
+            instance = getattr(instance, field_name)
+        return getattr(instance, '{}_id'.format(path[-1]))
+
+    def to_pk(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValidationError('Invalid pk "{}" - object does not exist.'.format(value))
+
+    def get_instances(self, rows):
+        pks = [self.to_pk(row.get('id')) for row in rows]
+        if len(set(pks)) != len(pks):
+            raise ValidationError('Each resource can only appear once.')
+        # The rows are only written, so their children aren't needed
+        instances = self.get_queryset().prefetch_related(None).in_bulk(pks)
+        if len(instances) != len(pks):
+            raise NotFound()
+        return [instances[pk] for pk in pks]
+
+    def get_parent_ids(self, rows, required):
+        parent_type = get_resource_type_from_model(self.parent_model)
+        parent_ids = []
+        for row in rows:
+            parent = row.get(self.parent_field)
+            if parent is None:
+                if required:
+                    raise ValidationError({self.parent_field: ['This field is required.']})
+                parent_ids.append(None)
+                continue
+            if not isinstance(parent, dict) or 'id' not in parent:
+                raise ValidationError({self.parent_field: ['Invalid resource identifier object.']})
+            if parent.get('type') != parent_type:
+                raise Conflict('Incorrect relation type. Expected {}, received {}.'.format(
+                    parent_type, parent.get('type')))
+            parent_ids.append(self.to_pk(parent['id']))
+
+        # Checks that every parent belongs to the team with one query
+        parent_projects = self.get_parent_projects({pk for pk in parent_ids if pk is not None})
+        for pk in parent_ids:
+            if pk is not None and pk not in parent_projects:
+                raise ValidationError({self.parent_field: ['Invalid pk "{}" - object does not exist.'.format(pk)]})
+        return parent_ids, parent_projects
+
+    def validate_row(self, row, instance=None):
+        serializer = self.serializer_class(instance, data=row, partial=instance is not None)
+        for field_name in list(serializer.fields.keys()):
+            if field_name not in self.bulk_fields:
+                serializer.fields.pop(field_name)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def delete_rows(self, pks):
+        self.model.objects.filter(pk__in=pks)._raw_delete(self.model.objects.db)
+
+    def refresh_projects(self, project_ids):
+        rebuild_rollups(Project.objects.filter(pk__in=project_ids))
+        invalidate_project_list(self.get_team_id())
+
+    def get_response(self, instances, status_code):
+        pks = [instance.pk for instance in instances]
+        instances = self.get_queryset().in_bulk(pks)
+        serializer = self.get_serializer([instances[pk] for pk in pks], many=True)
+        return Response(serializer.data, status=status_code)
+
+    def post(self, request, *args, **kwargs):
+        parent_ids, parent_projects = self.get_parent_ids(request.data, required=True)
+        instances = []
+        for row, parent_id in zip(request.data, parent_ids):
+            instance = self.model(**self.validate_row(row))
+            setattr(instance, '{}_id'.format(self.parent_field), parent_id)
+            instances.append(instance)
+
+        with transaction.atomic():
+            instances = self.model.objects.bulk_create(instances)
+            self.refresh_projects(set(parent_projects.values()))
+        return self.get_response(instances, status.HTTP_201_CREATED)
+
+    def patch(self, request, *args, **kwargs):
+        instances = self.get_instances(request.data)
+        parent_ids, parent_projects = self.get_parent_ids(request.data, required=False)
+        project_ids = set(parent_projects.values())
+        field_names = {'updated_at'}
+        now = timezone.now()
+        for row, instance, parent_id in zip(request.data, instances, parent_ids):
+            project_ids.add(self.get_project_id(instance))
+            for field_name, value in self.validate_row(row, instance).items():
+                setattr(instance, field_name, value)
+                field_names.add(field_name)
+            if parent_id is not None:
+                setattr(instance, '{}_id'.format(self.parent_field), parent_id)
+                field_names.add(self.parent_field)
+            instance.updated_at = now
+
+        with transaction.atomic():
+            bulk_update(instances, field_names)
+            self.refresh_projects(project_ids)
+        return self.get_response(instances, status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        instances = self.get_instances(request.data)
+        with transaction.atomic():
+            self.delete_rows([instance.pk for instance in instances])
+            self.refresh_projects({self.get_project_id(instance) for instance in instances})
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class CategoryBulkView(BulkView):
+    bulk_fields = ('name',)
+    model = Category
+    parent_field = 'project'
+    parent_model = Project
+    project_lookup = 'project'
+    resource_name = 'categories'
+    serializer_class = CategorySerializer
+
+    def get_queryset(self):
+        return Category.objects.filter(project__team_id=self.get_team_id()) \
+            .select_related('project').prefetch_related('items')
+
+    def delete_rows(self, pks):
+        # Raw deletes don't cascade, so the items go first
+        Item.objects.filter(category_id__in=pks)._raw_delete(Item.objects.db)
+        super(CategoryBulkView, self).delete_rows(pks)
+
+
+class ItemBulkView(BulkView):
+    bulk_fields = ('actual', 'description', 'estimated')
+    model = Item
+    parent_field = 'category'
+    parent_model = Category
+    project_lookup = 'category__project'
+    resource_name = 'items'
+    serializer_class = ItemSerializer
+
+    def get_queryset(self):
+        return Item.objects.filter(category__project__team_id=self.get_team_id()).select_related('category')
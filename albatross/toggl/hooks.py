@@ -1,126 +1,193 @@
-import math
+from collections import defaultdict
 from datetime import datetime, timedelta
+from decimal import Decimal
 
-from django.db import transaction
-from django.utils import timezone
+from django.utils.dateparse import parse_date
+from projects.imports import finish_import, get_import_window
+from projects.models import ProviderProjectLink, TimeEntry
 
 from .utils import Toggl
 
 
-def make_item_key(item):
-    return "{}:{}".format(item.category.name.lower(),
-                          item.description.lower())
+def find_toggl_project(toggl, project):
+    """
+    Returns the Toggl project that the project imports its hours from.
+    The stored link is used when it still points at a project with the
+    same name, otherwise the project is looked up by name and linked.
+    """
+    link = project.provider_links.filter(provider=ProviderProjectLink.TOGGL).first()
+    if link is not None:
+        toggl_project = toggl.getProject(link.provider_project_id)
+        if toggl_project and toggl_project.get('name') == project.name:
+            return toggl_project
+
+    # We want to get a detailed report (list of line items)
+    # for our project. That said, we don't know its id
+    # and toggl doesn't have an option to list all projects.
+    # It does however let you get projects for a particular
+    # client so we'll grab all the clients and get a project
+    # list that way.
+    clients = toggl.getClients()
+    toggl_projects = []
+    for client in clients:
+        clients_projects = toggl.getClientProjects(client['id'])
+        if clients_projects:
+            toggl_projects += clients_projects
+
+    # Right now we are assuming that every project has a unique name
+    # Note: Toggl requires a workspace id to get a detailed report
+    # so we need to grab the one associated with the project
+    for toggl_project in toggl_projects:
+        if toggl_project['name'] == project.name:
+            ProviderProjectLink.link(project, ProviderProjectLink.TOGGL,
+                                     toggl_project['id'], toggl_project['wid'])
+            return toggl_project
+    return None
+
+
+def make_time_entry(line_item, category_names):
+    # An entry belongs to the first of its tags that is one of
+    # our categories, or just its first tag if none of them are.
+    tags = [tag.lower() for tag in line_item['tags']]
+    matching_tags = [tag for tag in tags if tag in category_names]
+    # toggl returns duration in milliseconds
+    return TimeEntry(
+        category_name=(matching_tags or tags or [''])[0],
+        description=line_item['description'] or '',
+        hours=Decimal(line_item['dur']) / (1000 * 60 * 60),
+        provider_entry_id=line_item['id'],
+        spent_on=parse_date(line_item['start'][:10])
+    )
+
+
+def import_line_items(project, line_items, since):
+    category_names = {category.name.lower() for category
+                      in project.categories.all()}
+    time_entries = [make_time_entry(line_item, category_names)
+                    for line_item in line_items]
+    # Entries before the project's own window are already stored
+    if since is not None:
+        time_entries = [time_entry for time_entry in time_entries
+                        if time_entry.spent_on >= since]
+    return finish_import(project, ProviderProjectLink.TOGGL, time_entries, since)
+
+
+def get_report_since(since):
+    one_year_ago = datetime.now() - timedelta(weeks=52)
+    return (since or one_year_ago).strftime('%Y-%m-%d')
 
 
 class TogglDefaultHookset(object):
 
-    @transaction.atomic
     def update_project_line_item_times(self, api_credentials,
-                                       project_to_update):
+                                       project_to_update, reconcile=False):
         if not project_to_update.categories.all().exists():
-            return
+            return 0
 
         toggl = Toggl()
         toggl.setAPIKey(api_credentials)
 
-        # We want to get a detailed report (list of line items)
-        # for our project. That said, we don't know its id
-        # and toggl doesn't have an option to list all projects.
-        # It does however let you get projects for a particular
-        # client so we'll grab all the clients and get a project
-        # list that way.
-        clients = toggl.getClients()
-        toggl_projects = []
-        for client in clients:
-            clients_projects = toggl.getClientProjects(client['id'])
-            if clients_projects:
-                toggl_projects += clients_projects
-
-        # Right now we are assuming that every project has a unique name
-        # Note: Toggl requires a workspace id to get a detailed report
-        # so we need to grab the one associated with the project
-        project_id = None
-        workspace_id = None
-        for project in toggl_projects:
-            if project['name'] == project_to_update.name:
-                project_id = project['id']
-                workspace_id = project['wid']
-                break
-        if project_id is None:
-            return
-
-        # Get tags that correspond to our categories
-        all_tags = toggl.getTags()
-        project_to_update_categories = project_to_update.categories.all()
-        category_names = {category.name.lower() for category
-                          in project_to_update_categories}
-        ids_for_tags_that_match_categories = []
-        for tag in all_tags:
-            if tag['name'].lower() in category_names:
-                ids_for_tags_that_match_categories.append(tag['id'])
-
-        # Grab all line items tagged with our categories
-        # for our project over the last year.
-        one_year_ago = datetime.now() - timedelta(weeks=52)
+        toggl_project = find_toggl_project(toggl, project_to_update)
+        if toggl_project is None:
+            return 0
+
+        # Grab all line items for our project since the last import,
+        # or over the last year when everything has to be added up
+        # again. Line items with other tags are kept in the ledger too,
+        # so renaming a category doesn't mean downloading them again.
+        since = get_import_window(project_to_update, reconcile)
         toggl_report_criteria = {
-            'project_ids': project_id,
-            'since': one_year_ago.strftime('%Y-%m-%d'),
-            'tag_ids': ','.join([str(id) for id
-                                 in ids_for_tags_that_match_categories]),
+            'project_ids': toggl_project['id'],
+            'since': get_report_since(since),
             'without_description': 'false',
-            'workspace_id': workspace_id,
+            'workspace_id': toggl_project['wid'],
         }
-        toggl_report = toggl.getDetailedReport(data=toggl_report_criteria)
-
-        items_per_page = int(toggl_report['per_page'])
-        page = 2
-        toggl_line_items = toggl_report['data']
-        total_items = int(toggl_report['total_count'])
-        total_pages = math.ceil(total_items/items_per_page)
-        while page <= total_pages:
-            toggl_report_criteria['page'] = page
-            toggl_report = toggl.getDetailedReport(data=toggl_report_criteria)
-            toggl_line_items += toggl_report['data']
-            page += 1
-
-        # Add up the durations for all of the line items
-        # whose descriptions match the descriptions of our
-        # project's line items.
-        project_to_update_line_items = []
-        for category in project_to_update_categories:
-            line_items = category.items.all()
-            if line_items.exists():
-                project_to_update_line_items += list(line_items)
-        if not project_to_update_line_items:
-            return
-
-        line_items = {make_item_key(item) : item for item
-                      in project_to_update_line_items}
-        line_item_totals = {make_item_key(item): 0
-                            for item in project_to_update_line_items}
-
-        for line_item in toggl_line_items:
-            item_category_name = None
-            for tag in line_item['tags']:
-                if tag.lower() in category_names:
-                    item_category_name = tag.lower()
-                    break
-
-            item_key = "{}:{}".format(item_category_name,
-                                      line_item['description'].lower())
-            if item_key in line_item_totals:
-                total = line_item_totals[item_key]
-                total+= line_item['dur'] / (1000 * 60 * 60)
-                line_item_totals[item_key] = total
-                # toggl returns duration in milliseconds
-
-        for item_key, total in line_item_totals.items():
-            line_item = line_items[item_key]
-            line_item.actual = total
-            line_item.save()
-
-        project_to_update.last_imported_date = timezone.make_aware(datetime.now())
-        project_to_update.save()
+        toggl_line_items = toggl.getDetailedReportPages(data=toggl_report_criteria)
+        return import_line_items(project_to_update, toggl_line_items, since)
+
+    def update_team_line_item_times(self, api_credentials, projects,
+                                    reconcile=False):
+        """
+        Imports every one of a team's projects with one Toggl client.
+        The projects of the workspaces the team's projects are linked to
+        are listed once. A stored link is used when it still points at a
+        project with the same name, as in find_toggl_project, otherwise
+        the project is looked up by name in all of the workspaces and
+        linked again, or skipped when there's none. Each workspace's line
+        items are fetched in one report, then split up by project.
+        Returns the number of items whose actual hours changed.
+        """
+        projects = projects.filter(categories__isnull=False).distinct()
+        if not projects:
+            return 0
+
+        toggl = Toggl()
+        toggl.setAPIKey(api_credentials)
+
+        links = {link.project_id: link for link in ProviderProjectLink.objects.filter(
+            project__in=projects, provider=ProviderProjectLink.TOGGL, workspace_id__isnull=False)}
+        toggl_projects = {}
+        listed_workspace_ids = set()
+
+        def list_workspace_projects(workspace_id):
+            listed_workspace_ids.add(workspace_id)
+            for toggl_project in toggl.getWorkspaceProjects(workspace_id) or []:
+                toggl_projects[toggl_project['id']] = toggl_project
+
+        for workspace_id in {link.workspace_id for link in links.values()}:
+            list_workspace_projects(workspace_id)
+
+        linked_projects = {}
+        unlinked_projects = []
+        for project in projects:
+            link = links.get(project.id)
+            toggl_project = link and toggl_projects.get(link.provider_project_id)
+            if toggl_project and toggl_project['name'] == project.name:
+                linked_projects[project.id] = toggl_project
+            else:
+                unlinked_projects.append(project)
+
+        if unlinked_projects:
+            for workspace in toggl.getWorkspaces() or []:
+                if workspace['id'] not in listed_workspace_ids:
+                    list_workspace_projects(workspace['id'])
+            # Right now we are assuming that every project has a unique name
+            toggl_projects_by_name = {}
+            for toggl_project in toggl_projects.values():
+                toggl_projects_by_name.setdefault(toggl_project['name'], toggl_project)
+            for project in unlinked_projects:
+                toggl_project = toggl_projects_by_name.get(project.name)
+                if toggl_project is not None:
+                    ProviderProjectLink.link(project, ProviderProjectLink.TOGGL,
+                                             toggl_project['id'], toggl_project['wid'])
+                    linked_projects[project.id] = toggl_project
+
+        # Toggl project id -> [(project, since)] for each workspace
+        workspace_imports = defaultdict(lambda: defaultdict(list))
+        for project in projects:
+            toggl_project = linked_projects.get(project.id)
+            if toggl_project is not None:
+                workspace_imports[toggl_project['wid']][toggl_project['id']].append(
+                    (project, get_import_window(project, reconcile)))
+
+        changed = 0
+        for workspace_id, imports in workspace_imports.items():
+            windows = [since for project_imports in imports.values()
+                       for _, since in project_imports]
+            toggl_report_criteria = {
+                'project_ids': ','.join(str(project_id) for project_id in imports),
+                'since': get_report_since(None if None in windows else min(windows)),
+                'without_description': 'false',
+                'workspace_id': workspace_id,
+            }
+            line_items = defaultdict(list)
+            for line_item in toggl.getDetailedReportPages(data=toggl_report_criteria):
+                line_items[line_item['pid']].append(line_item)
+
+            for project_id, project_imports in imports.items():
+                for project, since in project_imports:
+                    changed += import_line_items(project, line_items[project_id], since)
+        return changed
 
 
 class HookProxy(object):
@@ -129,4 +196,4 @@ class HookProxy(object):
         return getattr(TogglDefaultHookset, attr)
 
 
-hookset = HookProxy()
\ No newline at end of file
+hookset = HookProxy()
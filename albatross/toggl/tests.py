@@ -1,13 +1,22 @@
 import json
+import mock
+import threading
+import time
 
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from datetime import datetime, timedelta
 from rest_framework.test import APITestCase, APIClient
 from authentication.models import UserProfile
-from projects.models import Category, Item, Project
+from projects.jobs import run_import_jobs
+from projects.models import Category, Item, Project, ProviderProjectLink
 from teams.models import Team
 
+from .hooks import find_toggl_project, hookset
+from .utils import Toggl
+
 class TogglTestCase(APITestCase):
     def setUp(self):
         # Create user
@@ -84,6 +93,9 @@ class TogglTestCase(APITestCase):
          response = self.client.post(
              reverse('project-update-actual-time', args=(self.project.id,))
          )
+         self.assertEqual(response.status_code, 202)
+         run_import_jobs()
+         response = self.client.get(reverse('project-detail', args=(self.project.id,)))
          self.assertEqual(response.status_code, 200)
          json_data = json.loads(response.content.decode('utf-8'))
 
@@ -111,3 +123,201 @@ class TogglTestCase(APITestCase):
                                    "%Y-%m-%dT%H:%M:%S.%fZ")
                  - datetime.now()
                  < timedelta(seconds=15))
+
+
+@override_settings(TOGGL_REQUESTS_PER_SECOND=0)
+class TogglDetailedReportTestCase(TestCase):
+    def test_pages_are_merged_in_order(self):
+        def get_detailed_report(data):
+            page = data.get('page', 1)
+            return {
+                'data': [{'description': '{}-{}'.format(page, index)} for index in range(2)],
+                'per_page': 2,
+                'total_count': 9
+            }
+
+        toggl = Toggl()
+        with mock.patch.object(toggl, 'getDetailedReport', side_effect=get_detailed_report) as report:
+            line_items = toggl.getDetailedReportPages({'project_ids': 1})
+
+        self.assertEqual(report.call_count, 5)
+        self.assertEqual([line_item['description'] for line_item in line_items],
+                         ['{}-{}'.format(page, index) for page in range(1, 6) for index in range(2)])
+
+    def test_single_page(self):
+        toggl = Toggl()
+        first_page = {'data': [{'description': 'Login'}], 'per_page': 50, 'total_count': 1}
+        with mock.patch.object(toggl, 'getDetailedReport', return_value=first_page) as report:
+            self.assertEqual(toggl.getDetailedReportPages({'project_ids': 1}), first_page['data'])
+        self.assertEqual(report.call_count, 1)
+
+    @override_settings(TOGGL_REQUESTS_PER_SECOND=20, TOGGL_REPORT_WORKERS=4)
+    def test_slow_pages_overlap_within_the_rate_limit(self):
+        lock = threading.Lock()
+        started = []
+        in_flight = [0, 0]
+
+        def request(endpoint, parameters=None):
+            with lock:
+                started.append(time.monotonic())
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            # Each page takes longer than the rate limit's interval
+            time.sleep(0.2)
+            with lock:
+                in_flight[0] -= 1
+            return {'data': [{'description': parameters.get('page', 1)}], 'per_page': 1, 'total_count': 5}
+
+        toggl = Toggl()
+        with mock.patch.object(toggl, 'request', side_effect=request):
+            line_items = toggl.getDetailedReportPages({'project_ids': 1})
+
+        self.assertEqual([line_item['description'] for line_item in line_items], [1, 2, 3, 4, 5])
+        self.assertGreater(in_flight[1], 1)
+        # Pages 2..5 still start at least 1/20 s apart
+        self.assertGreaterEqual(started[-1] - started[1], 0.145)
+
+    def test_only_report_pages_wait_on_the_rate_limit(self):
+        toggl = Toggl()
+        with mock.patch.object(toggl, 'request', return_value=[]), \
+                mock.patch.object(toggl.rate_limiter, 'wait') as wait:
+            toggl.getWorkspaces()
+            toggl.getClients()
+            wait.assert_not_called()
+            toggl.getDetailedReport({'project_ids': 1})
+        wait.assert_called_once_with()
+
+    def test_clients_have_their_own_api_keys(self):
+        toggl = Toggl()
+        other_toggl = Toggl()
+        toggl.setAPIKey('123')
+        other_toggl.setAPIKey('456')
+        self.assertNotEqual(toggl.headers['Authorization'], other_toggl.headers['Authorization'])
+
+
+class TogglProjectLinkTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='link@test.com', password='password125', username='link@test.com')
+        self.project = Project.objects.create(name='Website', team=Team.objects.create(name='Team', creator=user))
+        self.toggl = mock.MagicMock()
+        self.toggl.getClients.return_value = [{'id': 1}, {'id': 2}]
+        self.toggl.getClientProjects.side_effect = lambda client_id: [
+            {'id': client_id * 10, 'name': 'Website' if client_id == 2 else 'Other', 'wid': 7}
+        ]
+
+    def test_first_import_links_the_project(self):
+        toggl_project = find_toggl_project(self.toggl, self.project)
+        self.assertEqual(toggl_project['id'], 20)
+        link = ProviderProjectLink.objects.get(project=self.project, provider=ProviderProjectLink.TOGGL)
+        self.assertEqual(link.provider_project_id, 20)
+        self.assertEqual(link.workspace_id, 7)
+
+    def test_later_imports_skip_discovery(self):
+        ProviderProjectLink.link(self.project, ProviderProjectLink.TOGGL, 20, 7)
+        self.toggl.getProject.return_value = {'id': 20, 'name': 'Website', 'wid': 7}
+
+        toggl_project = find_toggl_project(self.toggl, self.project)
+        self.assertEqual(toggl_project['id'], 20)
+        self.toggl.getProject.assert_called_once_with(20)
+        self.toggl.getClients.assert_not_called()
+
+    def test_stale_link_is_resolved_again(self):
+        ProviderProjectLink.link(self.project, ProviderProjectLink.TOGGL, 30, 7)
+        self.toggl.getProject.return_value = {'id': 30, 'name': 'Renamed', 'wid': 7}
+
+        toggl_project = find_toggl_project(self.toggl, self.project)
+        self.assertEqual(toggl_project['id'], 20)
+        self.assertEqual(ProviderProjectLink.objects.get(project=self.project).provider_project_id, 20)
+
+
+class TogglTeamImportTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email='team@test.com', password='password125', username='team@test.com')
+        self.team = Team.objects.create(name='Team', creator=user)
+        for name in ('Website', 'App'):
+            project = Project.objects.create(name=name, team=self.team)
+            category = Category.objects.create(name='Design', project=project)
+            Item.objects.create(description='Mockups', actual=0, estimated=10, category=category)
+        self.toggl = mock.MagicMock()
+        self.toggl.getWorkspaces.return_value = [{'id': 7}]
+        self.toggl.getWorkspaceProjects.return_value = [
+            {'id': 20, 'name': 'Website', 'wid': 7},
+            {'id': 30, 'name': 'App', 'wid': 7}
+        ]
+        self.toggl.getDetailedReportPages.return_value = [
+            {'id': 1, 'pid': 20, 'tags': ['Design'], 'description': 'Mockups',
+             'dur': 2 * 60 * 60 * 1000, 'start': '2017-10-02T09:00:00-04:00'},
+            {'id': 2, 'pid': 30, 'tags': ['Design'], 'description': 'Mockups',
+             'dur': 3 * 60 * 60 * 1000, 'start': '2017-10-02T09:00:00-04:00'}
+        ]
+
+    def test_entries_are_fetched_outside_a_transaction(self):
+        savepoints = len(connection.savepoint_ids)
+        line_items = self.toggl.getDetailedReportPages.return_value
+        fetch_savepoints = []
+
+        def get_detailed_report_pages(data):
+            fetch_savepoints.append(len(connection.savepoint_ids))
+            return line_items
+        self.toggl.getDetailedReportPages.side_effect = get_detailed_report_pages
+
+        with mock.patch('toggl.hooks.Toggl', return_value=self.toggl):
+            hookset.update_team_line_item_times(self=hookset, api_credentials='123',
+                                                projects=self.team.projects.all())
+        self.assertEqual(fetch_savepoints, [savepoints])
+
+    def test_team_import_fetches_entries_once(self):
+        with mock.patch('toggl.hooks.Toggl', return_value=self.toggl):
+            changed = hookset.update_team_line_item_times(self=hookset, api_credentials='123',
+                                                          projects=self.team.projects.all())
+
+        self.assertEqual(changed, 2)
+        self.toggl.getDetailedReportPages.assert_called_once()
+        criteria = self.toggl.getDetailedReportPages.call_args[1]['data']
+        self.assertEqual(set(criteria['project_ids'].split(',')), {'20', '30'})
+        self.assertEqual(criteria['workspace_id'], 7)
+        self.assertEqual(Item.objects.get(category__project__name='Website').actual, 2)
+        self.assertEqual(Item.objects.get(category__project__name='App').actual, 3)
+        self.assertEqual(ProviderProjectLink.objects.filter(provider=ProviderProjectLink.TOGGL).count(), 2)
+
+    def test_team_import_uses_stored_links(self):
+        for project in self.team.projects.all():
+            ProviderProjectLink.link(project, ProviderProjectLink.TOGGL,
+                                     20 if project.name == 'Website' else 30, 7)
+        links_updated_at = dict(ProviderProjectLink.objects.values_list('pk', 'updated_at'))
+
+        with mock.patch('toggl.hooks.Toggl', return_value=self.toggl):
+            hookset.update_team_line_item_times(self=hookset, api_credentials='123',
+                                                projects=self.team.projects.all())
+
+        # Only the linked workspace is listed, to check the links
+        self.toggl.getWorkspaces.assert_not_called()
+        self.toggl.getWorkspaceProjects.assert_called_once_with(7)
+        self.assertEqual(dict(ProviderProjectLink.objects.values_list('pk', 'updated_at')), links_updated_at)
+        self.assertEqual(Item.objects.get(category__project__name='Website').actual, 2)
+        self.assertEqual(Item.objects.get(category__project__name='App').actual, 3)
+
+    def test_stale_links_are_resolved_again(self):
+        with mock.patch('toggl.hooks.Toggl', return_value=self.toggl):
+            hookset.update_team_line_item_times(self=hookset, api_credentials='123',
+                                                projects=self.team.projects.all())
+
+        # Website moved to a project in another workspace, and App's was deleted
+        self.toggl.getWorkspaces.return_value = [{'id': 7}, {'id': 8}]
+        self.toggl.getWorkspaceProjects.side_effect = lambda workspace_id: [
+            {'id': 20, 'name': 'Website (old)', 'wid': 7}
+        ] if workspace_id == 7 else [{'id': 40, 'name': 'Website', 'wid': 8}]
+        self.toggl.getDetailedReportPages.return_value = [
+            {'id': 3, 'pid': 40, 'tags': ['Design'], 'description': 'Mockups',
+             'dur': 4 * 60 * 60 * 1000, 'start': '2017-10-02T09:00:00-04:00'}
+        ]
+        with mock.patch('toggl.hooks.Toggl', return_value=self.toggl):
+            hookset.update_team_line_item_times(self=hookset, api_credentials='123',
+                                                projects=self.team.projects.all(), reconcile=True)
+
+        self.assertEqual(dict(ProviderProjectLink.objects.values_list('project__name', 'provider_project_id')),
+                         {'Website': 40, 'App': 30})
+        self.assertEqual(self.toggl.getDetailedReportPages.call_args[1]['data']['workspace_id'], 8)
+        self.assertEqual(Item.objects.get(category__project__name='Website').actual, 4)
+        # Projects whose link can't be resolved are left alone
+        self.assertEqual(Item.objects.get(category__project__name='App').actual, 3)
@@ -2,9 +2,14 @@
 # TogglPy is a non-cluttered, easily understood and implemented
 # library for interacting with the Toggl API.
 #--------------------------------------------------------------
+import math
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
 # parsing json data
-import json, requests
+import json
+
+from albatross_api import transport
+from django.conf import settings
 
 #---------------------------------------------
 # Class containing the endpoint URLs for Toggl
@@ -14,12 +19,19 @@ class Endpoints():
     def CLIENT_PROJECTS(cid):
         return "https://www.toggl.com/api/v8/clients/{}/projects".format(cid)
     CLIENTS = "https://www.toggl.com/api/v8/clients"
+    @staticmethod
+    def PROJECT(pid):
+        return "https://www.toggl.com/api/v8/projects/{}".format(pid)
     REPORT_WEEKLY = "https://toggl.com/reports/api/v2/weekly"
     REPORT_DETAILED = "https://toggl.com/reports/api/v2/details"
     REPORT_SUMMARY = "https://toggl.com/reports/api/v2/summary"
     TAGS = "https://toggl.com/api/v8/me?since=0&reason=initial+load&with_related_data=true&is_mobile=false&clientversion=4.5.0"
     WORKSPACES = "https://www.toggl.com/api/v8/workspaces"
 
+    @staticmethod
+    def WORKSPACE_PROJECTS(wid):
+        return "https://www.toggl.com/api/v8/workspaces/{}/projects".format(wid)
+
 #-------------------------------------------------------
 # Class containing the necessities for Toggl interaction
 #-------------------------------------------------------
@@ -35,6 +47,12 @@ class Toggl():
     # default API user agent value
     user_agent = "getalbatross.com"
 
+    def __init__(self):
+        # Each client gets its own headers and rate limit, so clients using
+        # different API keys can run at the same time.
+        self.headers = dict(self.headers)
+        self.rate_limiter = transport.RateLimiter(settings.TOGGL_REQUESTS_PER_SECOND)
+
     #-------------------------------------------------------------
     # Auxiliary methods
     #-------------------------------------------------------------
@@ -65,11 +83,11 @@ class Toggl():
     def request(self, endpoint, parameters=None):
         """make a request to the toggle api at a certain endpoint and return the page data as a parsed JSON dict"""
         if parameters == None:
-            return requests.get(endpoint, headers=self.headers).json()
+            return transport.get(endpoint, headers=self.headers).json()
         else:
             if 'user_agent' not in parameters:
                 parameters.update( {'user_agent' : self.user_agent,} ) # add our class-level user agent in there
-            return requests.get(endpoint, headers=self.headers, params=parameters).json()
+            return transport.get(endpoint, headers=self.headers, params=parameters).json()
 
     #-----------------------------------
     # Methods for getting tag data
@@ -108,6 +126,10 @@ class Toggl():
                     return workspace # if we find it return it
             return None # if we get to here and haven't found it return None
 
+    def getWorkspaceProjects(self, workspace_id):
+        """return all the projects in a workspace that are visable to a user"""
+        return self.request(Endpoints.WORKSPACE_PROJECTS(workspace_id))
+
     #--------------------------------
     # Methods for getting client data
     #--------------------------------
@@ -145,6 +167,16 @@ class Toggl():
             return None
         return self.request(Endpoints.CLIENT_PROJECTS(client_id))
 
+    def getProject(self, project_id):
+        """return the project with the given id, or None if it can't be found"""
+        try:
+            response = self.request(Endpoints.PROJECT(project_id))
+        except ValueError:
+            return None
+        if not isinstance(response, dict):
+            return None
+        return response.get('data')
+
     #---------------------------------
     # Methods for getting reports data
     #---------------------------------
@@ -163,8 +195,29 @@ class Toggl():
 
     def getDetailedReport(self, data):
         """return a detailed report for a user"""
+        # Report pages are fetched concurrently, so their requests are spaced
+        # out to stay within Toggl's rate limit
+        self.rate_limiter.wait()
         return self.request(Endpoints.REPORT_DETAILED, parameters=data)
 
+    def getDetailedReportPages(self, data):
+        """return the line items on every page of a detailed report, fetching pages 2..N concurrently"""
+        first_page = self.getDetailedReport(data=dict(data))
+        total_pages = math.ceil(int(first_page['total_count']) / int(first_page['per_page']))
+        line_items = list(first_page['data'])
+        if total_pages < 2:
+            return line_items
+
+        def get_page(page):
+            return self.getDetailedReport(data=dict(data, page=page))['data']
+
+        # map() returns the pages in order however they finish
+        workers = min(settings.TOGGL_REPORT_WORKERS, total_pages - 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for page_line_items in executor.map(get_page, range(2, total_pages + 1)):
+                line_items += page_line_items
+        return line_items
+
     def getDetailedReportPDF(self, data, filename):
         """save a detailed report as a pdf"""
         # get the raw pdf file data